@@ -1,29 +1,136 @@
 import torch
 import torch.nn.functional as F
 import tiktoken
-from ModelGPT2 import GPT, GPTConfig
+from gpt2.model import GPT, GPTConfig, KVCache
+from gpt2.weights import load_inference, load_pretrained
+
+def generate_tokens(model, tokens, max_length=32, device='cuda', use_cache=True, seed=42):
+        """
+        Samples (B, max_length) tokens continuing the (B, T) prompt `tokens` with top-50 sampling.
+        With use_cache each step only forwards the newly sampled token through the model and
+        reads the earlier keys/values from a KVCache, instead of re-running the whole sequence.
+        """
+        B, T = tokens.size()
+        if T >= max_length: #nothing to generate, the prompt cut to max_length
+            return tokens[:, :max_length].to(device)
+        # preallocated output buffer, the prompt is copied in and new tokens are written in place
+        xgen = torch.empty((B, max_length), dtype=torch.long, device=device)
+        xgen[:, :T] = tokens.to(device)
 
-def generate_text(model, prompt, num_return_sequences=4, max_length=32, device='cuda'):
-        model.eval()
-        enc = tiktoken.get_encoding('gpt2')
-        tokens = enc.encode(prompt)
-        tokens = torch.tensor(tokens, dtype=torch.long)
-        tokens = tokens.unsqueeze(0).repeat(num_return_sequences, 1)
-        xgen = tokens.to(device)
-        
         sample_rng = torch.Generator(device=device)
-        sample_rng.manual_seed(42)
-        
-        while xgen.size(1) < max_length:
-            with torch.no_grad():
-                logits, loss = model(xgen)  # (B, T, vocab_size)
+        sample_rng.manual_seed(seed)
+
+        raw_model = getattr(model, '_orig_mod', model) #unwrap torch.compile to get the config
+        kv_cache = KVCache(raw_model.config, B, max_len=max_length, device=device) if use_cache else None
+        x = xgen[:, :T] #the first forward is the whole prompt (prefill)
+
+        with torch.no_grad():
+            for t in range(T, max_length):
+                if use_cache:
+                    logits, loss = model(x, kv_cache=kv_cache)  # (B, T or 1, vocab_size)
+                else:
+                    logits, loss = model(xgen[:, :t])  # (B, t, vocab_size)
                 logits = logits[:, -1, :]  # (B, vocab_size)
                 probs = F.softmax(logits, dim=-1)  # get probabilities
                 topk_probs, topk_indices = torch.topk(probs, 50, dim=-1)  # topk sampling for top 50 probabilities
-                ix = torch.multinomial(topk_probs, 1, generator=sample_rng)  # (B,1), selecting a token from topk 
+                ix = torch.multinomial(topk_probs, 1, generator=sample_rng)  # (B,1), selecting a token from topk
                 xcol = torch.gather(topk_indices, -1, ix)  # gathering corresponding indices
-                xgen = torch.cat((xgen, xcol), dim=1)  # append to sequence
-        
+                xgen[:, t:t+1] = xcol  # write into the output buffer
+                x = xcol
+        return xgen
+
+def topk_distribution(logits, top_k=50, vocab_size=None):
+        # the top-k sampling distribution of generate_tokens as a full (..., vocab_size) vector, zero outside the top k.
+        # vocab_size pads it with zeros, for a draft model with a smaller vocab than the target
+        probs = F.softmax(logits.float(), dim=-1)
+        topk_probs, topk_indices = torch.topk(probs, top_k, dim=-1)
+        dist = torch.zeros((*probs.shape[:-1], vocab_size or probs.size(-1)), device=probs.device)
+        return dist.scatter_(-1, topk_indices, topk_probs / topk_probs.sum(dim=-1, keepdim=True))
+
+def speculative_generate_tokens(model, draft_model, tokens, max_length=32, device='cuda', num_draft=4, seed=42, top_k=50):
+        """
+        Speculative decoding: draft_model samples num_draft tokens ahead and model scores them all in
+        one forward pass. Draft token i is accepted with probability min(1, p_i/q_i) (target/draft
+        top-k distributions) and the first rejected one is replaced by a sample of max(p - q, 0), so
+        the output follows exactly the same distribution as generate_tokens with the target alone.
+        The rows of a batch share the KV cache position, so all of them keep the smallest number
+        of accepted tokens of the batch (each row still gets a correctly sampled next token).
+        Returns the (B, max_length) tokens and a dict of acceptance stats.
+        """
+        B, T = tokens.size()
+        stats = {'proposed': 0, 'accepted': 0, 'target_forwards': 0}
+        if T >= max_length: #nothing to generate, the prompt cut to max_length
+            return tokens[:, :max_length].to(device), {**stats, 'acceptance_rate': 0.0, 'tokens_per_forward': 0.0}
+        xgen = torch.empty((B, max_length), dtype=torch.long, device=device)
+        xgen[:, :T] = tokens.to(device)
+
+        sample_rng = torch.Generator(device=device)
+        sample_rng.manual_seed(seed)
+
+        config = getattr(model, '_orig_mod', model).config
+        draft_config = getattr(draft_model, '_orig_mod', draft_model).config
+        vocab_size = config.vocab_size #the draft only proposes tokens the target has (eg. 50304 padded vs 50257 HF)
+        kv_cache = KVCache(config, B, max_len=max_length, device=device)
+        draft_cache = KVCache(draft_config, B, max_len=max_length, device=device)
+
+        t = T #tokens generated so far, the caches hold all of them but the last one (or fewer for the draft)
+        with torch.no_grad():
+            while t < max_length:
+                k = min(num_draft, max_length - t - 1) #never cache past max_length
+                #draft k tokens, the first forward also catches the draft cache up on the committed tokens
+                draft = torch.empty((B, k), dtype=torch.long, device=device)
+                q = torch.empty((B, k, vocab_size), device=device)
+                x = xgen[:, draft_cache.pos:t]
+                for i in range(k):
+                    logits, _ = draft_model(x, kv_cache=draft_cache)
+                    q[:, i] = topk_distribution(logits[:, -1, :vocab_size], top_k, vocab_size)
+                    x = torch.multinomial(q[:, i], 1, generator=sample_rng)
+                    draft[:, i:i+1] = x
+                #one target forward over the uncached committed token(s) and all k drafts: k+1 distributions
+                logits, _ = model(torch.cat((xgen[:, kv_cache.pos:t], draft), dim=1), kv_cache=kv_cache)
+                p = topk_distribution(logits[:, -(k+1):, :], top_k)
+                stats['target_forwards'] += 1
+
+                #accept draft i with probability min(1, p/q), a row keeps its drafts up to the first rejection
+                p_draft = p[:, :k].gather(-1, draft.unsqueeze(-1)).squeeze(-1)
+                q_draft = q.gather(-1, draft.unsqueeze(-1)).squeeze(-1)
+                u = torch.rand((B, k), generator=sample_rng, device=device)
+                num_accepted = (u * q_draft < p_draft).long().cumprod(dim=-1).sum(dim=-1) #(B,)
+                n = int(num_accepted.min())
+                if n < k:
+                    #rows that rejected draft n resample from the residual, the others keep draft n (it was accepted)
+                    residual = (p[:, n] - q[:, n]).clamp(min=0)
+                    residual = torch.where(residual.sum(-1, keepdim=True) > 0, residual, p[:, n])
+                    resampled = torch.multinomial(residual, 1, generator=sample_rng).squeeze(-1)
+                    next_token = torch.where(num_accepted > n, draft[:, n], resampled)
+                else:
+                    next_token = torch.multinomial(p[:, k], 1, generator=sample_rng).squeeze(-1) #all accepted, one more from the target
+                xgen[:, t:t+n] = draft[:, :n]
+                xgen[:, t+n] = next_token
+                t += n + 1
+                #drop the rejected tokens from both caches
+                kv_cache.rollback(t - 1)
+                draft_cache.rollback(min(draft_cache.pos, t - 1))
+                stats['proposed'] += B * k
+                stats['accepted'] += int(num_accepted.sum())
+        stats['acceptance_rate'] = stats['accepted'] / max(stats['proposed'], 1)
+        stats['tokens_per_forward'] = (max_length - T) / max(stats['target_forwards'], 1)
+        return xgen, stats
+
+def generate_text(model, prompt, num_return_sequences=4, max_length=32, device='cuda', use_cache=True,
+                  draft_model=None, num_draft=4):
+        model.eval()
+        enc = tiktoken.get_encoding('gpt2')
+        tokens = enc.encode(prompt)
+        tokens = torch.tensor(tokens, dtype=torch.long)
+        tokens = tokens.unsqueeze(0).repeat(num_return_sequences, 1)
+        if draft_model is not None:
+            draft_model.eval()
+            xgen, stats = speculative_generate_tokens(model, draft_model, tokens, max_length=max_length, device=device, num_draft=num_draft)
+            print(f"draft acceptance rate: {stats['acceptance_rate']:.2f}, {stats['tokens_per_forward']:.2f} tokens per target forward")
+        else:
+            xgen = generate_tokens(model, tokens, max_length=max_length, device=device, use_cache=use_cache)
+
         generated_texts = []
         for i in range(num_return_sequences):
             tokens = xgen[i, :max_length].tolist()
@@ -31,18 +138,43 @@ def generate_text(model, prompt, num_return_sequences=4, max_length=32, device='
             generated_texts.append(decoded)
             print(f"Sample {i + 1}: {decoded}")
 
-        
+
         return generated_texts
-    
-
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-print(f"running with {device}")
-model = GPT(GPTConfig(vocab_size=50304)).to(device)
-prompt = "Hello, I'm a language model,"
-generated_texts = generate_text(
-        model=model,
-        prompt=prompt,
-        num_return_sequences=4,
-        max_length=32,
-        device=device
-    )
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", type=str, default=None, help="inference weights file written by gpt2.weights")
+    parser.add_argument("-p", "--pretrained", type=str, default=None, help="HF model type to load instead, eg. gpt2")
+    parser.add_argument("--prompt", type=str, default="Hello, I'm a language model,")
+    parser.add_argument("--num_return_sequences", type=int, default=4)
+    parser.add_argument("--max_length", type=int, default=32)
+    parser.add_argument("--draft_model", type=str, default=None, help="weights file of a smaller model for speculative decoding")
+    parser.add_argument("--draft_pretrained", type=str, default=None, help="HF model type of the draft model, eg. gpt2")
+    parser.add_argument("--num_draft", type=int, default=4, help="tokens the draft model proposes per target forward")
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    print(f"running with {device}")
+    if args.model is not None:
+        model = load_inference(args.model, device=device)
+    elif args.pretrained is not None:
+        model = load_pretrained(args.pretrained, device=device)
+    else:
+        print("no weights given, generating from a randomly initialized model")
+        model = GPT(GPTConfig(vocab_size=50304)).to(device)
+    draft_model = None
+    if args.draft_model is not None:
+        draft_model = load_inference(args.draft_model, device=device)
+    elif args.draft_pretrained is not None:
+        draft_model = load_pretrained(args.draft_pretrained, device=device)
+    generated_texts = generate_text(
+            model=model,
+            prompt=args.prompt,
+            num_return_sequences=args.num_return_sequences,
+            max_length=args.max_length,
+            device=device,
+            draft_model=draft_model,
+            num_draft=args.num_draft
+        )
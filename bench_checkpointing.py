@@ -0,0 +1,103 @@
+"""
+Activation checkpointing: checks that every setting gives the same loss and gradients as
+no checkpointing, then measures the activation memory per sequence and the forward/backward
+throughput of each, and from that the largest micro batch that fits in --memory_gb and the
+gradient accumulation steps needed for --total_batch_size. Activation memory is the size of
+the tensors autograd saves for the backward pass (on cuda the peak allocated memory is printed too).
+python bench_checkpointing.py --n_layer 12 --n_embd 768 --n_head 12 --T 1024 --device cuda --memory_gb 80
+"""
+import time
+import argparse
+import torch
+from gpt2.model import GPT, GPTConfig
+
+SETTINGS = {"none": ("none", 1), "mlp": ("mlp", 1), "block": ("block", 1), "block every 2": ("block", 2)}
+
+def make_model(args, setting):
+    torch.manual_seed(1337)
+    mode, every = SETTINGS[setting]
+    config = GPTConfig(block_size=args.T, vocab_size=50304, n_layer=args.n_layer, n_head=args.n_head, n_embd=args.n_embd,
+                       checkpoint_activations=mode, checkpoint_every=every)
+    model = GPT(config).to(args.device)
+    if args.compile:
+        model = torch.compile(model)
+    return model
+
+def saved_mb(model, x, y):
+    # bytes autograd keeps for the backward (each storage counted once), this is the activation
+    # memory checkpointing removes and is exact on any device
+    storages = {}
+    def pack(t):
+        storages[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16):
+            _, loss = model(x, y)
+    loss.backward()
+    params = {p.untyped_storage().data_ptr() for p in model.parameters()}
+    return sum(n for ptr, n in storages.items() if ptr not in params) / 2**20
+
+def check_equivalence(args):
+    x = torch.randint(0, 50304, (2, args.T), device=args.device)
+    y = torch.randint(0, 50304, (2, args.T), device=args.device)
+    ref = None
+    for setting in SETTINGS:
+        model = make_model(args, setting)
+        _, loss = model(x, y)
+        loss.backward()
+        grads = [p.grad for p in model.parameters()]
+        if ref is None:
+            ref = (loss.item(), grads)
+            continue
+        max_grad_diff = max((a - b).abs().max().item() for a, b in zip(ref[1], grads))
+        print(f"{setting:>14}: loss diff {abs(loss.item() - ref[0]):.2e} | max grad diff {max_grad_diff:.2e}")
+        assert abs(loss.item() - ref[0]) < 1e-5 and max_grad_diff < 1e-5, f"{setting} does not match no checkpointing"
+
+def measure(args, setting, B):
+    model = make_model(args, setting)
+    x = torch.randint(0, 50304, (B, args.T), device=args.device)
+    y = torch.randint(0, 50304, (B, args.T), device=args.device)
+    result = {'saved_mb': saved_mb(model, x, y)}
+    if args.device == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    best = float('inf')
+    for _ in range(args.steps):
+        t0 = time.time()
+        with torch.autocast(device_type=args.device, dtype=torch.bfloat16):
+            _, loss = model(x, y)
+        loss.backward()
+        if args.device == 'cuda':
+            torch.cuda.synchronize()
+        best = min(best, time.time() - t0)
+    result['tok_per_sec'] = B * args.T / best
+    if args.device == 'cuda':
+        result['peak_mb'] = torch.cuda.max_memory_allocated() / 2**20
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_layer", type=int, default=4)
+    parser.add_argument("--n_head", type=int, default=4)
+    parser.add_argument("--n_embd", type=int, default=256)
+    parser.add_argument("--B", type=int, default=4, help="micro batch of the measurement, it is also run at 2*B to fit the memory per sequence")
+    parser.add_argument("--T", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--memory_gb", type=float, default=2.0, help="activation memory budget for the largest micro batch")
+    parser.add_argument("--total_batch_size", type=int, default=524288)
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    check_equivalence(args)
+    for setting in SETTINGS:
+        small, large = measure(args, setting, args.B), measure(args, setting, 2 * args.B)
+        per_seq = (large['saved_mb'] - small['saved_mb']) / args.B #the part that grows with the batch
+        fixed = small['saved_mb'] - per_seq * args.B
+        max_B = int((args.memory_gb * 1024 - fixed) // per_seq)
+        max_B = min(max_B, args.total_batch_size // args.T) #no use for a micro batch larger than the whole batch
+        max_B = 2 ** (max_B.bit_length() - 1) if max_B > 0 else 0 #power of 2 so it divides the total batch
+        accum = max(1, args.total_batch_size // (max_B * args.T)) if max_B > 0 else float('inf')
+        peak = f" | peak {large['peak_mb']:.0f}MB" if 'peak_mb' in large else ""
+        print(f"{setting:>14}: {per_seq:.1f}MB/sequence saved for backward{peak} | {large['tok_per_sec']:.0f} tok/sec at B={2 * args.B} | "
+              f"max B {max_B} in {args.memory_gb:g}GB -> {accum} grad accum steps")
@@ -0,0 +1,77 @@
+"""
+Compares the fused chunked lm_head + cross entropy loss against building the full logits:
+checks that loss and gradients match, then measures peak memory and throughput of a
+forward/backward pass. Each measurement runs in a fresh process so peak RSS is comparable.
+python bench_chunked_loss.py --B 8 --T 1024
+"""
+import time
+import resource
+import argparse
+import multiprocessing as mp
+import torch
+from gpt2.model import GPT, GPTConfig
+
+def make_model(args, loss_chunk_size):
+    torch.manual_seed(1337)
+    config = GPTConfig(vocab_size=50304, n_layer=args.n_layer, n_head=args.n_head, n_embd=args.n_embd,
+                       loss_chunk_size=loss_chunk_size)
+    return GPT(config).to(args.device)
+
+def check_equivalence(args):
+    model = make_model(args, loss_chunk_size=args.chunk_size)
+    x = torch.randint(0, 50304, (2, 256), device=args.device)
+    y = torch.randint(0, 50304, (2, 256), device=args.device)
+    for autocast in (False, True):
+        with torch.autocast(device_type=args.device, dtype=torch.bfloat16, enabled=autocast):
+            _, loss_full = model(x, y, return_logits=True)
+        loss_full.backward()
+        grads_full = [p.grad.clone() for p in model.parameters()]
+        model.zero_grad()
+        with torch.autocast(device_type=args.device, dtype=torch.bfloat16, enabled=autocast):
+            _, loss_chunked = model(x, y)
+        loss_chunked.backward()
+        grads_chunked = [p.grad.clone() for p in model.parameters()]
+        model.zero_grad()
+        tol = 2e-2 if autocast else 1e-4
+        max_grad_diff = max((a - b).abs().max().item() / (a.abs().max().item() + 1e-12) for a, b in zip(grads_full, grads_chunked))
+        print(f"autocast={autocast} | loss full {loss_full.item():.6f} chunked {loss_chunked.item():.6f} | max rel grad diff {max_grad_diff:.2e}")
+        assert abs(loss_full.item() - loss_chunked.item()) < tol, "loss mismatch"
+        assert max_grad_diff < tol, "gradient mismatch"
+
+def measure(args, loss_chunk_size, result):
+    model = make_model(args, loss_chunk_size)
+    x = torch.randint(0, 50304, (args.B, args.T), device=args.device)
+    y = torch.randint(0, 50304, (args.B, args.T), device=args.device)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    best = float('inf')
+    for _ in range(args.steps):
+        t0 = time.time()
+        with torch.autocast(device_type=args.device, dtype=torch.bfloat16):
+            _, loss = model(x, y)
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+        best = min(best, time.time() - t0)
+    result['peak_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - base_rss
+    result['tok_per_sec'] = args.B * args.T / best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_layer", type=int, default=2)
+    parser.add_argument("--n_head", type=int, default=4)
+    parser.add_argument("--n_embd", type=int, default=256)
+    parser.add_argument("--B", type=int, default=4)
+    parser.add_argument("--T", type=int, default=1024)
+    parser.add_argument("--chunk_size", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    check_equivalence(args)
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        for name, chunk in (("full logits", 0), (f"chunked ({args.chunk_size})", args.chunk_size)):
+            result = manager.dict()
+            p = ctx.Process(target=measure, args=(args, chunk, result))
+            p.start()
+            p.join()
+            print(f"{name:>16}: peak +{result['peak_mb']:.0f}MB | {result['tok_per_sec']:.0f} tok/sec")
@@ -0,0 +1,77 @@
+"""
+Tokenizes a local text/JSONL file with the batched shard pipeline in fineweb.py and with the
+old one-document-at-a-time pool.imap loop, checks that both write the same shards, then
+interrupts a run (drops the last shards from the manifest) and checks the resumed run writes
+them again identically.
+python bench_fineweb.py --source test/input.txt --shard_size 50000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import fineweb
+
+def tokenize_doc(text):
+    # the old per-document path: python list -> int64 array -> uint16 array
+    enc = fineweb.get_encoding()
+    tokens = [enc._special_tokens['<|endoftext|>']]
+    tokens.extend(enc.encode_ordinary(text))
+    return np.array(tokens).astype(np.uint16)
+
+def reference_shards(args):
+    shards = []
+    buf = np.empty((args.shard_size,), dtype=np.uint16)
+    token_count = 0
+    with mp.Pool(args.nprocs) as pool:
+        for tokens in pool.imap(tokenize_doc, fineweb.iterate_documents(args.source), chunksize=16):
+            while token_count + len(tokens) >= args.shard_size:
+                remainder = args.shard_size - token_count
+                buf[token_count:] = tokens[:remainder]
+                shards.append(buf.copy())
+                tokens = tokens[remainder:]
+                token_count = 0
+            buf[token_count:token_count+len(tokens)] = tokens
+            token_count += len(tokens)
+    if token_count != 0:
+        shards.append(buf[:token_count].copy())
+    return shards
+
+def read_shards(out_dir, manifest):
+    return [np.load(os.path.join(out_dir, s['file'])) for s in manifest['shards']]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, default=os.path.join("test", "input.txt"))
+    parser.add_argument("--shard_size", type=int, default=50000)
+    parser.add_argument("--nprocs", type=int, default=max(1, os.cpu_count()//2))
+    parser.add_argument("--batch_docs", type=int, default=256)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    reference = reference_shards(args)
+    t_reference = time.time() - t0
+    out_dir = tempfile.mkdtemp(prefix="bench_fineweb_")
+    t0 = time.time()
+    manifest = fineweb.tokenize_to_shards(args.source, out_dir, args.shard_size, nprocs=args.nprocs, batch_docs=args.batch_docs)
+    t_batched = time.time() - t0
+    shards = read_shards(out_dir, manifest)
+    num_tokens = sum(len(s) for s in reference)
+    assert len(shards) == len(reference) and all(np.array_equal(a, b) for a, b in zip(shards, reference)), "shards differ"
+    print(f"per document: {num_tokens / t_reference:.0f} tok/sec | batched: {num_tokens / t_batched:.0f} tok/sec | "
+          f"{len(shards)} identical shards, {num_tokens} tokens")
+
+    #pretend the run died after writing half of the shards
+    keep = len(shards) // 2
+    dropped = manifest['shards'][keep:]
+    manifest['shards'], manifest['complete'] = manifest['shards'][:keep], False
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    for s in dropped:
+        os.remove(os.path.join(out_dir, s['file']))
+    manifest = fineweb.tokenize_to_shards(args.source, out_dir, args.shard_size, nprocs=args.nprocs, batch_docs=args.batch_docs)
+    shards = read_shards(out_dir, manifest)
+    assert len(shards) == len(reference) and all(np.array_equal(a, b) for a, b in zip(shards, reference)), "resumed shards differ"
+    print(f"resumed after shard {keep - 1}: all {len(shards)} shards identical")
@@ -0,0 +1,41 @@
+"""
+Measures process startup cost of the library imports, each in a fresh interpreter.
+`import torch` is timed on its own as the floor that any model import has to pay.
+python bench_import.py --repeats 5
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+IMPORTS = {
+    "python": "pass",
+    "torch": "import torch",
+    "gpt2": "import gpt2",
+    "gpt2.model": "from gpt2.model import GPT, GPTConfig",
+    "gpt2.train": "import gpt2.train",
+    "Generate_text": "from Generate_text import generate_text",
+    "hellaswag": "import hellaswag",
+}
+
+def time_import(stmt, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        #run from the repo root so gpt2, Generate_text and hellaswag import from wherever the bench is started
+        subprocess.run([sys.executable, "-c", stmt], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    times = {name: time_import(stmt, args.repeats) for name, stmt in IMPORTS.items()}
+    for name, dt in times.items():
+        line = f"{name:>14}: {(dt - times['python'])*1000:8.1f}ms"
+        if name not in ("python", "torch", "gpt2"):
+            line += f" | {(dt - times['torch'])*1000:+.1f}ms over torch"
+        print(line)
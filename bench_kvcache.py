@@ -0,0 +1,47 @@
+"""
+Benchmarks cached (KVCache) against uncached decoding on CPU
+and checks that both paths produce the same tokens.
+python bench_kvcache.py --n_layer 12 --n_embd 768 --max_length 256
+"""
+import time
+import argparse
+import torch
+from gpt2.model import GPT, GPTConfig
+from Generate_text import generate_tokens
+
+def time_generate(model, tokens, max_length, device, use_cache, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        t0 = time.time()
+        xgen = generate_tokens(model, tokens, max_length=max_length, device=device, use_cache=use_cache)
+        best = min(best, time.time() - t0)
+    return xgen, best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_layer", type=int, default=6)
+    parser.add_argument("--n_head", type=int, default=6)
+    parser.add_argument("--n_embd", type=int, default=384)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--prompt_length", type=int, default=8)
+    parser.add_argument("--max_length", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(1337)
+    config = GPTConfig(block_size=max(1024, args.max_length), vocab_size=50304,
+                       n_layer=args.n_layer, n_head=args.n_head, n_embd=args.n_embd)
+    model = GPT(config).to(args.device)
+    model.eval()
+    tokens = torch.randint(0, 50257, (1, args.prompt_length)).repeat(args.batch_size, 1)
+
+    new_tokens = args.batch_size * (args.max_length - args.prompt_length)
+    x_nocache, dt_nocache = time_generate(model, tokens, args.max_length, args.device, False, args.repeats)
+    x_cache, dt_cache = time_generate(model, tokens, args.max_length, args.device, True, args.repeats)
+
+    mismatches = (x_nocache != x_cache).sum().item()
+    print(f"uncached: {dt_nocache*1000:.1f}ms | {new_tokens/dt_nocache:.1f} tok/sec")
+    print(f"cached:   {dt_cache*1000:.1f}ms | {new_tokens/dt_cache:.1f} tok/sec")
+    print(f"speedup: {dt_nocache/dt_cache:.2f}x | mismatched tokens: {mismatches}/{x_cache.numel()}")
+    assert mismatches == 0, "cached and uncached decoding diverged"
@@ -0,0 +1,84 @@
+"""
+Compares the int8 quantized model (each matmul mode) against fp32 on cpu:
+weight memory, decode tokens/sec, agreement of the logits, and (when the data is there)
+val loss on the FineWeb val shard and HellaSwag acc_norm.
+python bench_quantize.py --pretrained gpt2 --val_steps 20 --hellaswag
+"""
+import time
+import copy
+import argparse
+import torch
+from torch.nn import functional as F
+from gpt2.model import GPT, GPTConfig
+from gpt2.weights import load_inference, load_pretrained
+from gpt2.quantize import quantize_model, MODES
+from Generate_text import generate_tokens
+
+def model_bytes(model):
+    seen = set()
+    total = 0
+    for t in list(model.parameters()) + list(model.buffers()):
+        if t.data_ptr() not in seen: #tied tensors only count once
+            seen.add(t.data_ptr())
+            total += t.numel() * t.element_size()
+    return total
+
+def decode_tok_per_sec(model, args):
+    tokens = torch.randint(0, 50257, (args.batch_size, 8))
+    generate_tokens(model, tokens, max_length=16, device='cpu') #warmup
+    t0 = time.time()
+    generate_tokens(model, tokens, max_length=args.max_length, device='cpu')
+    return args.batch_size * (args.max_length - 8) / (time.time() - t0)
+
+@torch.no_grad()
+def val_loss(model, args):
+    from gpt2.data import DataLoaderLite
+    T = min(1024, model.config.block_size)
+    loader = DataLoaderLite(B=4, T=T, process_rank=0, num_processes=1, split="val", data_root=args.data_root, verbose=False)
+    loss_accum = 0.0
+    for _ in range(args.val_steps):
+        x, y = loader.next_batch()
+        _, loss = model(x, y)
+        loss_accum += loss.item() / args.val_steps
+    return loss_accum
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", type=str, default=None, help="inference weights file written by gpt2.weights")
+    parser.add_argument("-p", "--pretrained", type=str, default=None, help="HF model type, eg. gpt2")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--max_length", type=int, default=128)
+    parser.add_argument("--data_root", type=str, default="edu_fineweb10B")
+    parser.add_argument("--val_steps", type=int, default=0, help="val batches for the loss comparison, 0 to skip")
+    parser.add_argument("--hellaswag", action="store_true", help="also compare HellaSwag acc_norm (slow on cpu)")
+    args = parser.parse_args()
+
+    torch.manual_seed(1337)
+    if args.model is not None:
+        model = load_inference(args.model).float()
+    elif args.pretrained is not None:
+        model = load_pretrained(args.pretrained).float()
+    else:
+        print("no weights given, comparing on a randomly initialized model")
+        model = GPT(GPTConfig(vocab_size=50304)).eval()
+    models = {"fp32": model}
+    for mode in MODES:
+        models[f"int8 {mode}"] = quantize_model(copy.deepcopy(model), mode=mode)
+
+    x = torch.randint(0, 50257, (4, 256))
+    with torch.no_grad():
+        logits, _ = model(x)
+    for name, m in models.items():
+        r = {'weights_mb': model_bytes(m) / 2**20, 'decode_tok_per_sec': decode_tok_per_sec(m, args)}
+        if m is not model:
+            with torch.no_grad():
+                qlogits, _ = m(x)
+            r['kl_vs_fp32'] = F.kl_div(F.log_softmax(qlogits, -1), F.log_softmax(logits, -1), log_target=True, reduction='batchmean').item()
+            r['top1_agreement'] = (logits.argmax(-1) == qlogits.argmax(-1)).float().mean().item()
+        if args.val_steps > 0:
+            r['val_loss'] = val_loss(m, args)
+        if args.hellaswag:
+            from hellaswag import evaluate_batched
+            num_correct_norm, num_total = evaluate_batched(m, 'cpu', 'cpu', autocast=False) #fp32 reference, not bf16
+            r['acc_norm'] = num_correct_norm / num_total
+        print(f"{name:>14}: " + " | ".join(f"{k}: {v:.4f}" for k, v in r.items()))
@@ -0,0 +1,87 @@
+"""
+Document index and shuffled sampling in DataLoaderLite on synthetic shards with known
+document boundaries: checks the index, that shuffled batches are seeded, disjoint between
+ranks and cover every window once per epoch, that aligned windows start at documents and
+that resuming from state_dict continues the same order. Then times building the index of a
+full size (100M token) shard and drawing batches, against the sequential loader.
+python bench_sampler.py --shard_size 100000000 --num_shards 2
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from gpt2.data import DataLoaderLite, EOT, load_doc_index, doc_index_path
+
+def write_shards(data_root, num_shards, shard_size, mean_doc_len, seed=0):
+    # random tokens with an eot before every document, documents of geometric length
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_root, exist_ok=True)
+    doc_starts = []
+    for s in range(num_shards):
+        tokens = rng.integers(0, EOT, size=shard_size, dtype=np.uint16)
+        starts = np.cumsum(rng.geometric(1 / mean_doc_len, size=shard_size // mean_doc_len * 2))
+        starts = starts[starts < shard_size]
+        tokens[starts] = EOT
+        np.save(os.path.join(data_root, f"synthetic_train_{s:06d}.npy"), tokens)
+        doc_starts.append(starts)
+    return doc_starts
+
+def collect(loader, num_batches):
+    return [loader.next_batch()[0] for _ in range(num_batches)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_shards", type=int, default=2)
+    parser.add_argument("--shard_size", type=int, default=int(1e7))
+    parser.add_argument("--mean_doc_len", type=int, default=1000)
+    parser.add_argument("--B", type=int, default=64)
+    parser.add_argument("--T", type=int, default=1024)
+    parser.add_argument("--batches", type=int, default=50)
+    args = parser.parse_args()
+
+    data_root = tempfile.mkdtemp(prefix="bench_sampler_")
+    doc_starts = write_shards(data_root, args.num_shards, args.shard_size, args.mean_doc_len)
+    shards = sorted(os.path.join(data_root, s) for s in os.listdir(data_root))
+    t0 = time.time()
+    for shard, starts in zip(shards, doc_starts):
+        index = load_doc_index(shard) #not there yet, so built from the memory-mapped shard and saved
+        assert np.array_equal(index, starts) and os.path.exists(doc_index_path(shard)), "wrong document index"
+    dt = (time.time() - t0) / len(shards)
+    print(f"index: {dt:.2f}s per {args.shard_size} token shard -> ~{dt * 1e10 / args.shard_size:.0f}s for 10B tokens, "
+          f"{os.path.getsize(doc_index_path(shards[0])) / 2**20:.1f}MB per shard")
+
+    #small windows so an epoch is cheap to walk through
+    B, T = 4, 64
+    small = [DataLoaderLite(B, T, r, 2, "train", data_root, verbose=False, shuffle=True, seed=1) for r in range(2)]
+    per_epoch = small[0].num_windows // (2 * B)
+    starts = set()
+    for r, loader in enumerate(small):
+        for _ in range(per_epoch):
+            first = loader.current_batch * 2 * B + r * B
+            starts.update(int(i) for i in loader.order[first:first + B])
+            loader.next_batch()
+    assert len(starts) == per_epoch * 2 * B, "windows repeated within an epoch or shared between ranks"
+    epoch_0 = small[0].order.copy()
+    small[0].next_batch()
+    assert small[0].epoch == 1 and not np.array_equal(epoch_0, small[0].order), "not reshuffled at the epoch end"
+    a, b = (DataLoaderLite(B, T, 0, 2, "train", data_root, verbose=False, shuffle=True, seed=1) for _ in range(2))
+    assert all((x == y).all() for x, y in zip(collect(a, 3), collect(b, 3))), "not seeded"
+    state = a.state_dict()
+    expected = collect(a, 3)
+    a.load_state_dict(state)
+    assert all((x == y).all() for x, y in zip(expected, collect(a, 3))), "resume does not continue the order"
+    aligned = DataLoaderLite(B, T, 1, 2, "train", data_root, verbose=False, shuffle=True, align_docs=True, seed=1)
+    assert all((x[:, 0] == EOT).all() for x in collect(aligned, 20)), "aligned windows must start at a document"
+    print("shuffled sampler: disjoint ranks, one pass per epoch, seeded, resumable, aligned windows start at documents")
+
+    for name, kwargs in (("sequential", {}), ("shuffled", {'shuffle': True}), ("shuffled aligned", {'shuffle': True, 'align_docs': True})):
+        t0 = time.time()
+        loader = DataLoaderLite(args.B, args.T, 0, 1, "train", data_root, verbose=False, **kwargs)
+        t_init = time.time() - t0
+        loader.next_batch()
+        t0 = time.time()
+        for _ in range(args.batches):
+            loader.next_batch()
+        dt = (time.time() - t0) / args.batches
+        print(f"{name:>16}: init {t_init * 1000:.0f}ms | {dt * 1000:.2f}ms per ({args.B}, {args.T}) batch")
@@ -0,0 +1,109 @@
+"""
+Speculative decoding on cpu. First checks that speculative_generate_tokens samples from the
+same distribution as generate_tokens: drafting with the target itself accepts everything, and
+the token histograms of a small target with a different draft match plain sampling within
+sampling noise (batched and one row at a time). Then reports the acceptance rate, tokens per
+target forward and end-to-end speedup over generate_tokens for draft/target pairs: HF GPT-2
+sizes with --pretrained, otherwise small byte-level models trained on test/input.txt first.
+python bench_speculative.py --pretrained gpt2-medium:gpt2 gpt2-large:gpt2
+"""
+import time
+import argparse
+import numpy as np
+import torch
+from gpt2.model import GPT, GPTConfig
+from Generate_text import generate_tokens, speculative_generate_tokens
+
+def tv_distance(a, b, pos, vocab_size):
+    pa = torch.bincount(a[:, pos], minlength=vocab_size).float() / a.size(0)
+    pb = torch.bincount(b[:, pos], minlength=vocab_size).float() / b.size(0)
+    return 0.5 * (pa - pb).abs().sum().item()
+
+def check_exactness():
+    torch.manual_seed(0)
+    target = GPT(GPTConfig(block_size=64, vocab_size=64, n_layer=2, n_head=2, n_embd=32)).eval()
+    draft = GPT(GPTConfig(block_size=64, vocab_size=72, n_layer=1, n_head=2, n_embd=32)).eval() #padded vocab, like 50304 vs 50257
+    with torch.no_grad(): #sharper distributions than at init, so target and draft disagree a lot
+        target.lm_head.weight.mul_(4)
+        draft.lm_head.weight.mul_(4)
+    prompt = torch.randint(0, 64, (1, 4))
+    _, stats = speculative_generate_tokens(target, target, prompt, max_length=24, device='cpu', num_draft=4)
+    assert stats['acceptance_rate'] == 1.0, "the target drafting for itself must accept every token"
+
+    L, N = 8, 20000
+    reference = generate_tokens(target, prompt.repeat(N, 1), max_length=L, device='cpu', seed=1)
+    plain = generate_tokens(target, prompt.repeat(N, 1), max_length=L, device='cpu', seed=2)
+    batched, stats = speculative_generate_tokens(target, draft, prompt.repeat(N, 1), max_length=L, device='cpu', seed=3)
+    n1 = 2000 #one row at a time, so several drafts get accepted per target forward
+    single = torch.cat([speculative_generate_tokens(target, draft, prompt, max_length=L, device='cpu', seed=s)[0] for s in range(n1)])
+    for pos in range(prompt.size(1), L):
+        noise = tv_distance(reference, plain, pos, 72)
+        tv_batched, tv_single = tv_distance(reference, batched, pos, 72), tv_distance(reference[:n1], single, pos, 72)
+        noise_single = tv_distance(reference[:n1], plain[:n1], pos, 72)
+        print(f"token {pos}: total variation vs plain sampling {tv_batched:.3f} batched, {tv_single:.3f} single row "
+              f"(sampling noise {noise:.3f}, {noise_single:.3f})")
+        assert tv_batched < 2 * noise + 0.02 and tv_single < 2 * noise_single + 0.02, "speculative sampling changed the distribution"
+    print(f"exact: acceptance {stats['acceptance_rate']:.2f} for the mismatched draft, output distribution unchanged")
+
+def train_bytes(config, data, steps, B=16, T=64):
+    torch.manual_seed(0)
+    model = GPT(config)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=2e-3)
+    for _ in range(steps):
+        ix = torch.randint(0, len(data) - T - 1, (B,))
+        x = torch.stack([data[i:i+T] for i in ix])
+        y = torch.stack([data[i+1:i+T+1] for i in ix])
+        _, loss = model(x, y)
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+    print(f"trained {config.n_layer}x{config.n_embd}: loss {loss.item():.3f}")
+    return model.eval()
+
+def byte_pairs(args):
+    data = torch.from_numpy(np.frombuffer(open(args.text, 'rb').read(), dtype=np.uint8).astype(np.int64))
+    def config(n_layer, n_head, n_embd):
+        return GPTConfig(block_size=512, vocab_size=256, n_layer=n_layer, n_head=n_head, n_embd=n_embd)
+    target = train_bytes(config(4, 4, 256), data, args.train_steps)
+    drafts = {'1x64': train_bytes(config(1, 2, 64), data, args.train_steps),
+              '2x128': train_bytes(config(2, 4, 128), data, args.train_steps)}
+    prompt = data[:16].unsqueeze(0)
+    return [(f"4x256 <- {name}", target, draft, prompt) for name, draft in drafts.items()]
+
+def pretrained_pairs(args):
+    import tiktoken
+    from gpt2.weights import load_pretrained
+    prompt = torch.tensor(tiktoken.get_encoding('gpt2').encode("Hello, I'm a language model,")).unsqueeze(0)
+    models = {}
+    for name in {n for pair in args.pretrained for n in pair.split(":")}:
+        models[name] = load_pretrained(name).float()
+    pairs = []
+    for pair in args.pretrained:
+        target, draft = pair.split(":")
+        pairs.append((f"{target} <- {draft}", models[target], models[draft], prompt))
+    return pairs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pretrained", type=str, nargs="*", default=None, help="target:draft HF model types, eg. gpt2-medium:gpt2")
+    parser.add_argument("--text", type=str, default="test/input.txt", help="training text for the byte-level pairs")
+    parser.add_argument("--train_steps", type=int, default=200)
+    parser.add_argument("--max_length", type=int, default=272)
+    parser.add_argument("--num_draft", type=int, nargs="+", default=[2, 4, 6])
+    args = parser.parse_args()
+
+    check_exactness()
+    pairs = pretrained_pairs(args) if args.pretrained else byte_pairs(args)
+    for name, target, draft, prompt in pairs:
+        new_tokens = args.max_length - prompt.size(1)
+        generate_tokens(target, prompt, max_length=prompt.size(1) + 8, device='cpu') #warmup
+        t0 = time.time()
+        generate_tokens(target, prompt, max_length=args.max_length, device='cpu')
+        t_plain = time.time() - t0
+        print(f"{name}: plain {new_tokens / t_plain:.1f} tok/sec")
+        for k in args.num_draft:
+            t0 = time.time()
+            _, stats = speculative_generate_tokens(target, draft, prompt, max_length=args.max_length, device='cpu', num_draft=k)
+            dt = time.time() - t0
+            print(f"{name:>20} k={k}: acceptance {stats['acceptance_rate']:.2f} | {stats['tokens_per_forward']:.2f} tokens per target forward | "
+                  f"{new_tokens / dt:.1f} tok/sec | speedup {t_plain / dt:.2f}x")
@@ -0,0 +1,235 @@
+"""
+Benchmark suite on cpu with small GPTConfig sizes, so a change to GPT, DataLoaderLite,
+generation or the HellaSwag eval shows up as a number instead of a feeling:
+forward/backward tok/sec, AdamW step time, data loader batches/sec (sequential and shuffled),
+generation latency per token, HellaSwag examples/sec and import time. Every benchmark runs
+with the plain fp32 eager setup ("base") and with one option turned on at a time (torch.compile,
+bf16 autocast, fused AdamW) where the option applies. Results go to a JSON file; --compare
+checks them against a saved baseline and exits with 1 if anything got slower than --threshold
+or fails where the baseline ran.
+HellaSwag runs on random synthetic examples unless --hellaswag_split names a cached real split.
+python bench_suite.py --out bench_baseline.json
+python bench_suite.py --out bench_new.json --compare bench_baseline.json --threshold 0.1
+python bench_suite.py --results bench_new.json --compare bench_baseline.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+import numpy as np
+import torch
+import hellaswag
+from gpt2.model import GPT, GPTConfig
+from gpt2.data import DataLoaderLite, EOT
+from Generate_text import generate_tokens
+from bench_import import time_import
+
+CONFIGS = {
+    'tiny': dict(n_layer=2, n_head=2, n_embd=64),
+    'small': dict(n_layer=4, n_head=4, n_embd=256),
+}
+OPTIONS = {
+    'base': {},
+    'compile': {'compile': True},
+    'autocast': {'autocast': True},
+    'fused_adamw': {'fused': True},
+}
+#the options each benchmark is run with, besides base
+APPLIES = {
+    'forward_backward': ('compile', 'autocast'),
+    'optimizer_step': ('fused_adamw',),
+    'generation': ('autocast',), #compiling the kv cache decode loop recompiles for every new length
+    'hellaswag': ('compile', 'autocast'),
+}
+IMPORTS = ("torch", "gpt2.model", "gpt2.train", "Generate_text", "hellaswag")
+
+def measure(fn, warmup, repeats):
+    # median seconds per call, after warmup calls (which also absorb compilation)
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+def make_model(config, option):
+    torch.manual_seed(0)
+    model = GPT(GPTConfig(block_size=256, vocab_size=50304, **CONFIGS[config]))
+    return torch.compile(model) if option.get('compile') else model
+
+def autocast(option):
+    return torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=option.get('autocast', False))
+
+#_______________________________________________________________________________
+
+def bench_forward_backward(config, option, args):
+    model = make_model(config, option)
+    x = torch.randint(0, 50257, (args.B, args.T))
+    y = torch.randint(0, 50257, (args.B, args.T))
+    def step():
+        with autocast(option):
+            _, loss = model(x, y)
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+    dt = measure(step, args.warmup, args.repeats)
+    return args.B * args.T / dt, "tok/sec", True
+
+def bench_optimizer_step(config, option, args):
+    model = make_model(config, option)
+    optimizer = model.configure_optimizers(weight_decay=0.1, learning_rate=6e-4, device_type='cpu', verbose=False,
+                                           fused=option.get('fused', False))
+    for p in model.parameters():
+        p.grad = torch.randn_like(p) * 1e-3
+    dt = measure(optimizer.step, args.warmup, args.repeats)
+    return dt * 1000, "ms", False
+
+def bench_generation(config, option, args):
+    model = make_model(config, option).eval()
+    prompt = torch.randint(0, 50257, (1, 16))
+    def generate():
+        with autocast(option):
+            generate_tokens(model, prompt, max_length=16 + args.new_tokens, device='cpu')
+    dt = measure(generate, 1, args.repeats)
+    return dt * 1000 / args.new_tokens, "ms/token", False
+
+def bench_hellaswag(config, option, args):
+    model = make_model(config, option).eval()
+    def evaluate():
+        return hellaswag.evaluate_batched(model, 'cpu', 'cpu', split=args.hellaswag_split, batch_size=8,
+                                          autocast=option.get('autocast', False))[1]
+    num_examples = evaluate() #warmup, compiles every padded length once
+    dt = measure(evaluate, 0, max(1, args.repeats // 2))
+    return num_examples / dt, "examples/sec", True
+
+def write_hellaswag_split(split, num_examples=128, seed=0):
+    # random examples in the hellaswag_{split}.npz layout of hellaswag.tokenize_split
+    rng = np.random.default_rng(seed)
+    rows, ctx_lens = [], []
+    for _ in range(num_examples):
+        ctx = rng.integers(0, 50257, rng.integers(20, 80)).tolist()
+        ctx_lens.append(len(ctx))
+        rows.extend(ctx + rng.integers(0, 50257, rng.integers(5, 30)).tolist() for _ in range(4))
+    row_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    row_offsets[1:] = np.cumsum([len(row) for row in rows])
+    np.savez(os.path.join(hellaswag.DATA_CACHE_DIR, f"hellaswag_{split}.npz"), tokens=np.concatenate(rows).astype(np.uint16),
+             row_offsets=row_offsets, ctx_lens=np.array(ctx_lens, dtype=np.int32), labels=rng.integers(0, 4, num_examples))
+
+def bench_loader(data_root, loader_kwargs, args):
+    loader = DataLoaderLite(args.B, args.T, 0, 1, "train", data_root, verbose=False, **loader_kwargs)
+    dt = measure(loader.next_batch, args.warmup, args.repeats * 20)
+    return 1 / dt, "batches/sec", True
+
+def bench_import_time(module, python, args):
+    # in a fresh interpreter, minus the startup of python itself
+    return (time_import(f"import {module}", args.import_repeats) - python) * 1000, "ms", False
+
+def write_shards(data_root, num_shards=2, shard_size=2**21, seed=0):
+    rng = np.random.default_rng(seed)
+    for s in range(num_shards):
+        tokens = rng.integers(0, EOT, size=shard_size, dtype=np.uint16)
+        tokens[rng.integers(0, shard_size, shard_size // 1000)] = EOT
+        np.save(os.path.join(data_root, f"bench_train_{s:06d}.npy"), tokens)
+
+def run(args):
+    results = {}
+    def record(name, fn, *fn_args):
+        try:
+            value, unit, higher_is_better = fn(*fn_args)
+            results[name] = {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+            print(f"{name:>40}: {value:10.2f} {unit}")
+        except Exception as e: #eg. no compiler for torch.compile, keep going with the rest
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+            print(f"{name:>40}: failed, {results[name]['error'][:200]}")
+
+    benchmarks = {'forward_backward': bench_forward_backward, 'optimizer_step': bench_optimizer_step,
+                  'generation': bench_generation, 'hellaswag': bench_hellaswag}
+    tmp = tempfile.mkdtemp(prefix="bench_suite_")
+    if 'hellaswag' in args.benchmarks and args.hellaswag_split == "bench":
+        hellaswag.DATA_CACHE_DIR = tmp #synthetic split, keeps the real cache untouched
+        write_hellaswag_split("bench")
+    for config in args.configs:
+        for bench in args.benchmarks:
+            if bench not in benchmarks:
+                continue
+            for option_name in ('base',) + APPLIES[bench]:
+                if option_name in args.options:
+                    record(f"{bench}/{config}/{option_name}", benchmarks[bench], config, OPTIONS[option_name], args)
+    if 'loader' in args.benchmarks:
+        write_shards(tmp)
+        for name, loader_kwargs in (("sequential", {}), ("shuffled", {'shuffle': True})):
+            record(f"loader/{name}", bench_loader, tmp, loader_kwargs, args)
+    if 'import' in args.benchmarks:
+        python = time_import("pass", args.import_repeats)
+        for module in IMPORTS:
+            record(f"import/{module}", bench_import_time, module, python, args)
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of every result against the baseline and returns the names that regressed:
+    slower by more than threshold, or failed/missing where the baseline has a value.
+    """
+    regressions = []
+    for name, b in baseline.items():
+        if 'value' in b and 'value' not in results.get(name, {}): #worked in the baseline, failed or missing now
+            print(f"{name:>40}: {b['value']:10.2f} -> {results.get(name, {}).get('error', 'missing')[:200]}  <-- REGRESSION")
+            regressions.append(name)
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None or 'value' not in r or 'value' not in b:
+            continue
+        change = r['value'] / b['value'] - 1
+        worse = -change if r['higher_is_better'] else change #positive means slower
+        flag = ""
+        if worse > threshold:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = "  improved"
+        print(f"{name:>40}: {b['value']:10.2f} -> {r['value']:10.2f} {r['unit']:<12} ({change:+.1%}){flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=str, default="bench_results.json")
+    parser.add_argument("--compare", type=str, default=None, help="baseline JSON to check the results against")
+    parser.add_argument("--results", type=str, default=None, help="compare this saved JSON instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown that counts as a regression")
+    parser.add_argument("--configs", type=str, nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument("--benchmarks", type=str, nargs="+", default=list(APPLIES) + ['loader', 'import'],
+                        choices=list(APPLIES) + ['loader', 'import'])
+    parser.add_argument("--options", type=str, nargs="+", default=list(OPTIONS), choices=list(OPTIONS))
+    parser.add_argument("--B", type=int, default=4)
+    parser.add_argument("--T", type=int, default=128)
+    parser.add_argument("--new_tokens", type=int, default=32, help="tokens generated per generation run")
+    parser.add_argument("--hellaswag_split", type=str, default="bench", help="'bench' for synthetic examples, or a cached real split")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--import_repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.results is not None:
+        with open(args.results) as f:
+            results = json.load(f)['results']
+    else:
+        results = run(args)
+        meta = {'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'torch': torch.__version__, 'python': platform.python_version(),
+                'machine': platform.machine(), 'processor': platform.processor(), 'num_threads': torch.get_num_threads(),
+                'args': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'results')}}
+        with open(args.out, "w") as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+        print(f"wrote {len(results)} results to {args.out}")
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"no regressions over {args.threshold:.0%}")
@@ -3,85 +3,244 @@ FineWeb-Edu dataset (for srs pretraining)
 https://huggingface.co/datasets/HuggingFaceFW/fineweb-edu
 Downloads and tokenizes the data and saves data shards to disk.
 Will save shards to the local directory "edu_fineweb10B".
+Documents are tokenized in batches by a process pool and copied into a preallocated uint16
+shard buffer, full shards are written by a background thread and recorded in manifest.json,
+so an interrupted run picks up after the last shard that made it to disk. Every shard gets a
+.docs.npy index of its document start offsets for the shuffled data loader.
+Local files can be used instead of the HF dataset: .txt (documents separated by blank lines)
+or .jsonl (one {"text": ...} document per line).
+python fineweb.py
+python fineweb.py --source test/input.txt --local_dir shakespeare --shard_size 100000
 """
 import os
+import json
+import time
+import queue
+import argparse
+import itertools
+import threading
 import multiprocessing as mp
 import numpy as np
-import tiktoken
-from datasets import load_dataset 
-from tqdm import tqdm 
-
-
-local_dir = "edu_fineweb10B"
-remote_name = "sample-10BT"
-shard_size = int(1e8) # 100M tokens per shard, total of 100 shards
-
-DATA_CACHE_DIR = os.path.join(os.path.dirname(__file__), local_dir)
-os.makedirs(DATA_CACHE_DIR, exist_ok=True)
-print("Shards will be saved to:",DATA_CACHE_DIR)
-
-#dataset download
-fw = load_dataset("HuggingFaceFW/fineweb-edu", name=remote_name, split="train")
-
-#tokenizer
-enc = tiktoken.get_encoding("gpt2")
-eot = enc._special_tokens['<|endoftext|>'] # end of text token
-
-def tokenize(doc):
-    # tokenizes a single document and returns a numpy array of uint16 tokens
-    tokens = [eot]
-    tokens.extend(enc.encode_ordinary(doc["text"]))
-    tokens_np = np.array(tokens)
-    assert (0 <= tokens_np).all() and (tokens_np < 2**16).all(), "token dictionary too large for uint16"
-    tokens_np_uint16 = tokens_np.astype(np.uint16)
-    return tokens_np_uint16
-
-def write_datafile(filename, tokens_np):
-    np.save(filename, tokens_np)
-
-
-# # FOR WINDOWS\\\\Wrap the multiprocessing code inside '__main__'
-# if __name__ == '__main__':
-#     from multiprocessing import freeze_support
-#     freeze_support()  # Optional, but good for Windows executables
-#     # tokenize all documents and write output shards, each of shard_size tokens (last shard has remainder)
-
-
-nprocs = max(1, os.cpu_count()//2)
-with mp.Pool(nprocs) as pool:
-    shard_index = 0
-    # preallocate buffer to hold current shard
-    all_tokens_np = np.empty((shard_size,), dtype=np.uint16)
-    token_count = 0
-    progress_bar = None
-    for tokens in pool.imap(tokenize, fw, chunksize=16):
-
-        # is there enough space in the current shard for the new tokens?
-        if token_count + len(tokens) < shard_size:
-            # simply append tokens to current shard
-            all_tokens_np[token_count:token_count+len(tokens)] = tokens
-            token_count += len(tokens)
-            # update progress bar
-            if progress_bar is None:
-                progress_bar = tqdm(total=shard_size, unit="tokens", desc=f"Shard {shard_index}")
-            progress_bar.update(len(tokens))
-        else:
-            # write the current shard and start a new one
-            split = "val" if shard_index == 0 else "train"
-            filename = os.path.join(DATA_CACHE_DIR, f"edufineweb_{split}_{shard_index:06d}")
-            # split the document into whatever fits in this shard; the remainder goes to next one
-            remainder = shard_size - token_count
-            progress_bar.update(remainder)
-            all_tokens_np[token_count:token_count+remainder] = tokens[:remainder]
-            write_datafile(filename, all_tokens_np)
-            shard_index += 1
-            progress_bar = None
-            # populate the next shard with the leftovers of the current doc
-            all_tokens_np[0:len(tokens)-remainder] = tokens[remainder:]
-            token_count = len(tokens)-remainder
+from tqdm import tqdm
+from gpt2.data import build_doc_index, save_doc_index
+#_______________________________________________________________________________
+
+enc = None
+
+def get_encoding():
+    #created on first use in every pool worker instead of at import
+    global enc
+    if enc is None:
+        import tiktoken
+        enc = tiktoken.get_encoding("gpt2")
+        assert enc.n_vocab <= 2**16, "token dictionary too large for uint16"
+    return enc
+
+def tokenize_batch(texts):
+    # tokenizes a batch of documents into one uint16 array, every document starts with eot.
+    # returns the tokens and the length of each document (eot included)
+    enc = get_encoding()
+    eot = enc._special_tokens['<|endoftext|>'] # end of text token
+    #plain loop, encode_ordinary_batch goes through a thread pool which is slower inside a pool worker
+    docs = [enc.encode_ordinary(text) for text in texts]
+    lengths = np.fromiter((len(d) + 1 for d in docs), dtype=np.int64, count=len(docs))
+    tokens = np.empty(int(lengths.sum()), dtype=np.uint16)
+    starts = np.cumsum(lengths) - lengths
+    body = np.ones(len(tokens), dtype=bool)
+    body[starts] = False
+    tokens[starts] = eot
+    tokens[body] = np.fromiter(itertools.chain.from_iterable(docs), dtype=np.uint16, count=len(tokens) - len(docs))
+    return tokens, lengths
+
+def iterate_documents(source, remote_name="sample-10BT", text_key="text", start=0):
+    # yields the text of every document from `start` on, from the HF dataset or a local .txt/.jsonl file
+    if os.path.isfile(source):
+        yield from itertools.islice(iterate_local_documents(source, text_key), start, None)
+    else:
+        from datasets import load_dataset
+        fw = load_dataset(source, name=remote_name, split="train")
+        if start > 0:
+            fw = fw.select(range(start, len(fw))) #skips without reading the rows
+        for doc in fw:
+            yield doc[text_key]
+
+def iterate_local_documents(source, text_key="text"):
+    # .jsonl: one json document per line, anything else: plain text with blank lines between documents
+    if source.endswith(".jsonl"):
+        with open(source, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)[text_key]
+    else:
+        with open(source, encoding="utf-8") as f:
+            lines = []
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                elif lines:
+                    yield "".join(lines)
+                    lines = []
+            if lines:
+                yield "".join(lines)
+
+def batched(iterable, n):
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+
+class ShardWriter:
+    """
+    Writes full shards on a background thread while the next one is being filled. Buffers are
+    preallocated once and recycled, and the manifest is rewritten after every shard so it only
+    ever lists shards that are completely on disk. After a failed write the shards still queued
+    are dropped, so the manifest never lists a shard that comes after a missing one.
+    """
+
+    def __init__(self, out_dir, prefix, shard_size, manifest, eot, num_buffers=2):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.eot = eot
+        self.manifest = manifest
+        self.free = queue.Queue()
+        for _ in range(num_buffers):
+            self.free.put(np.empty((shard_size,), dtype=np.uint16))
+        self.pending = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def buffer(self):
+        if self.error is not None:
+            raise self.error
+        return self.free.get()
+
+    def write(self, buf, shard_index, num_tokens, next_doc, next_offset):
+        # next_doc/next_offset: where the following shard starts in the document stream, for resuming
+        self.pending.put((buf, shard_index, num_tokens, next_doc, next_offset))
+
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            buf, shard_index, num_tokens, next_doc, next_offset = item
+            if self.error is not None: #after a failed shard nothing more goes into the manifest, a resume starts at that shard
+                self.free.put(buf)
+                continue
+            try:
+                split = "val" if shard_index == 0 else "train"
+                filename = f"{self.prefix}_{split}_{shard_index:06d}.npy"
+                path = os.path.join(self.out_dir, filename)
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, buf[:num_tokens])
+                os.replace(path + ".tmp", path)
+                doc_index = build_doc_index(buf[:num_tokens], self.eot)
+                save_doc_index(path, doc_index)
+                self.manifest['shards'].append({'file': filename, 'tokens': num_tokens, 'docs': len(doc_index),
+                                                'next_doc': next_doc, 'next_offset': next_offset})
+                save_manifest(self.out_dir, self.manifest)
+            except Exception as e:
+                self.error = e
+            self.free.put(buf)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def load_manifest(out_dir, settings):
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {**settings, 'shards': [], 'complete': False}
+    with open(path) as f:
+        manifest = json.load(f)
+    for k, v in settings.items():
+        assert manifest[k] == v, f"{out_dir} was written with {k}={manifest[k]}, not {v}, use another --local_dir"
+    return manifest
+
+def tokenize_to_shards(source, out_dir, shard_size=int(1e8), prefix="edufineweb", remote_name="sample-10BT",
+                       text_key="text", nprocs=None, batch_docs=256):
+    """
+    Tokenizes every document of `source` into shards of shard_size tokens (the first one is the
+    val split, the last one has the remainder). Resumes from out_dir/manifest.json if there is one.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir, {'source': source, 'remote_name': remote_name, 'shard_size': shard_size, 'prefix': prefix})
+    if manifest['complete']:
+        print(f"all {len(manifest['shards'])} shards already in {out_dir}")
+        return manifest
+    start_doc, skip = 0, 0
+    if manifest['shards']:
+        start_doc, skip = manifest['shards'][-1]['next_doc'], manifest['shards'][-1]['next_offset']
+        print(f"resuming at shard {len(manifest['shards'])}, document {start_doc}")
+
+    writer = ShardWriter(out_dir, prefix, shard_size, manifest, get_encoding()._special_tokens['<|endoftext|>'])
+    nprocs = nprocs or max(1, os.cpu_count()//2)
+    t0 = time.time()
+    total_tokens = 0
+    docs = iterate_documents(source, remote_name, text_key, start=start_doc)
+    with mp.Pool(nprocs) as pool:
+        buf = writer.buffer()
+        token_count = 0
+        shard_index = len(manifest['shards'])
+        doc_index = start_doc #first document of the current batch
+        progress_bar = tqdm(total=shard_size, unit="tokens", desc=f"Shard {shard_index}")
+        for tokens, lengths in pool.imap(tokenize_batch, batched(docs, batch_docs)):
+            ends = np.cumsum(lengths)
+            pos, skip = skip, 0 #the start of the first document went into the last shard written before the resume
+            while pos < len(tokens):
+                n = min(shard_size - token_count, len(tokens) - pos)
+                buf[token_count:token_count+n] = tokens[pos:pos+n]
+                token_count += n
+                pos += n
+                progress_bar.update(n)
+                if token_count == shard_size:
+                    # split the document into whatever fits in this shard; the remainder goes to next one
+                    j = int(np.searchsorted(ends, pos, side='right'))
+                    next_offset = pos - int(ends[j] - lengths[j]) if j < len(lengths) else 0
+                    writer.write(buf, shard_index, token_count, doc_index + j, next_offset)
+                    total_tokens += token_count
+                    buf = writer.buffer()
+                    shard_index += 1
+                    token_count = 0
+                    progress_bar.close()
+                    progress_bar = tqdm(total=shard_size, unit="tokens", desc=f"Shard {shard_index}")
+            doc_index += len(lengths)
+        progress_bar.close()
 
     # write any remaining tokens as the last shard
     if token_count != 0:
-        split = "val" if shard_index == 0 else "train"
-        filename = os.path.join(DATA_CACHE_DIR, f"edufineweb_{split}_{shard_index:06d}")
-        write_datafile(filename, all_tokens_np[:token_count])
\ No newline at end of file
+        writer.write(buf, shard_index, token_count, doc_index, 0)
+        total_tokens += token_count
+    writer.close()
+    manifest['complete'] = True
+    save_manifest(out_dir, manifest)
+    dt = time.time() - t0
+    print(f"wrote {total_tokens} tokens in {dt:.1f}s ({total_tokens / dt:.0f} tok/sec), {len(manifest['shards'])} shards in {out_dir}")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, default="HuggingFaceFW/fineweb-edu", help="HF dataset name or a local .txt/.jsonl file")
+    parser.add_argument("--remote_name", type=str, default="sample-10BT")
+    parser.add_argument("--text_key", type=str, default="text", help="field holding the document text in the dataset/.jsonl")
+    parser.add_argument("--local_dir", type=str, default="edu_fineweb10B")
+    parser.add_argument("--prefix", type=str, default="edufineweb")
+    parser.add_argument("--shard_size", type=int, default=int(1e8), help="100M tokens per shard, total of 100 shards")
+    parser.add_argument("--nprocs", type=int, default=None)
+    parser.add_argument("--batch_docs", type=int, default=256, help="documents per tokenizer call")
+    args = parser.parse_args()
+
+    DATA_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.local_dir)
+    print("Shards will be saved to:",DATA_CACHE_DIR)
+    tokenize_to_shards(args.source, DATA_CACHE_DIR, args.shard_size, args.prefix, args.remote_name,
+                       args.text_key, args.nprocs, args.batch_docs)
@@ -0,0 +1,28 @@
+"""
+GPT-2 reproduction as an importable package.
+Submodules are imported on first attribute access, so `import gpt2` doesn't pull in torch
+and nothing runs at import time. Training lives in gpt2.train (python -m gpt2.train).
+"""
+import importlib
+
+_exports = {
+    'GPT': 'model',
+    'GPTConfig': 'model',
+    'KVCache': 'model',
+    'SlotKVCache': 'model',
+    'DataLoaderLite': 'data',
+    'PrefetchLoader': 'data',
+    'CheckpointWriter': 'checkpoint',
+    'load_inference': 'weights',
+    'load_pretrained': 'weights',
+    'InferenceEngine': 'serve',
+    'quantize_model': 'quantize',
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(f"{__name__}.{_exports[name]}")
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
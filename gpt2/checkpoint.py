@@ -0,0 +1,61 @@
+"""
+Background checkpoint writing with keep-last-N retention.
+"""
+import os
+import threading
+import torch
+#_______________________________________________________________________________
+
+def to_cpu(obj):
+    # copy every tensor in a (nested) checkpoint dict to cpu, so training can keep updating the originals
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+def list_checkpoints(log_dir):
+    names = sorted(f for f in os.listdir(log_dir) if f.startswith("model_") and f.endswith(".pt"))
+    return [os.path.join(log_dir, f) for f in names]
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread. save() snapshots the state to cpu and returns,
+    the file is written to a temporary name and atomically renamed into log_dir/model_XXXXX.pt,
+    and only the newest keep_last checkpoints are kept. At most one write is in flight,
+    a new save() first waits for the previous one.
+    """
+
+    def __init__(self, log_dir, keep_last=3):
+        self.log_dir = log_dir
+        self.keep_last = keep_last
+        self.thread = None
+        self.error = None
+
+    def save(self, step, checkpoint):
+        self.wait()
+        checkpoint = to_cpu(checkpoint)
+        path = os.path.join(self.log_dir, f"model_{step:05d}.pt")
+        self.thread = threading.Thread(target=self._write, args=(checkpoint, path), daemon=True)
+        self.thread.start()
+
+    def _write(self, checkpoint, path):
+        try:
+            tmp_path = path + ".tmp"
+            torch.save(checkpoint, tmp_path)
+            os.replace(tmp_path, path)
+            if self.keep_last > 0:
+                for old_path in list_checkpoints(self.log_dir)[:-self.keep_last]:
+                    os.remove(old_path)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
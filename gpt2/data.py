@@ -0,0 +1,257 @@
+"""
+Token shard loading: DataLoaderLite walks the memory-mapped .npy shards written by fineweb.py,
+or with shuffle=True draws random windows from all of them, PrefetchLoader runs it on a
+background thread. Each shard can have a .docs.npy index next to it with the offsets of its
+documents (the eot token fineweb.py puts before every document).
+"""
+import os
+import queue
+import threading
+import numpy as np
+import torch
+#_______________________________________________________________________________
+
+EOT = 50256 #<|endoftext|>
+
+def load_tokens(filename):
+    # memory-map the uint16 shard instead of reading it in, pages are only touched
+    # when next_batch slices them so switching shards is basically free
+    npt = np.load(filename, mmap_mode='r')
+    return npt
+
+def doc_index_path(shard_path):
+    return shard_path[:-len(".npy")] + ".docs.npy"
+
+def build_doc_index(tokens, eot=EOT, chunk_size=2**24):
+    # offsets of the document starts (eot tokens) as uint32, scanned a chunk at a time so a
+    # memory-mapped shard is streamed through instead of compared all at once
+    starts = [np.flatnonzero(tokens[i:i+chunk_size] == eot) + i for i in range(0, len(tokens), chunk_size)]
+    return np.concatenate(starts).astype(np.uint32) if starts else np.zeros(0, dtype=np.uint32)
+
+def save_doc_index(shard_path, index):
+    path = doc_index_path(shard_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp" #several ranks may build the same index
+    with open(tmp_path, "wb") as f:
+        np.save(f, index)
+    os.replace(tmp_path, path)
+
+def load_doc_index(shard_path, eot=EOT):
+    # the index fineweb.py wrote with the shard, built (and saved) here for shards that don't have one
+    path = doc_index_path(shard_path)
+    if os.path.exists(path):
+        return np.load(path)
+    index = build_doc_index(load_tokens(shard_path), eot)
+    save_doc_index(shard_path, index)
+    return index
+
+#Data loader
+class DataLoaderLite:
+    """
+    Sequential by default: every rank walks the shards in order with a rank-strided offset.
+    shuffle=True instead splits all shards into windows of T+1 tokens (consecutive ones, or one
+    starting at every document with align_docs=True) and visits them in a seeded random order
+    that is reshuffled every epoch, each batch taking B windows and the ranks disjoint ones.
+    """
+    def __init__(self, B, T, process_rank, num_processes, split, data_root="edu_fineweb10B", verbose=True,
+                 shuffle=False, align_docs=False, seed=1337, eot=EOT):
+        self.B = B
+        self.T = T
+        self.process_rank = process_rank
+        self.num_processes = num_processes
+        self.shuffle = shuffle
+        self.align_docs = align_docs
+        self.seed = seed
+        self.eot = eot
+        assert split in {'train', 'val'}
+        
+        #get the shard filenames
+        shards = os.listdir(data_root)
+        shards = [s for s in shards if split in s and s.endswith(".npy") and not s.endswith(".docs.npy")]
+        shards = sorted(shards)
+        shards = [os.path.join(data_root, s) for s in shards]
+        self.shards = shards
+        assert len(shards)> 0, f"no shards found for split {split}"   
+        if verbose:
+            print(f"found {len(shards)} shards for split {split}")  
+        if shuffle:
+            self._build_windows()
+            if verbose:
+                print(f"shuffling {self.num_windows} windows{' aligned to documents' if align_docs else ''}")
+        self.reset() 
+
+    def _build_windows(self):
+        # window i of the dataset is window i - window_offsets[s] of shard s
+        T = self.T
+        self.shard_tokens = [load_tokens(s) for s in self.shards]
+        if self.align_docs:
+            self.window_starts = []
+            for shard, tokens in zip(self.shards, self.shard_tokens):
+                starts = load_doc_index(shard, self.eot)
+                self.window_starts.append(starts[starts.astype(np.int64) + T + 1 <= len(tokens)])
+            counts = [len(starts) for starts in self.window_starts]
+        else:
+            counts = [(len(tokens) - 1) // T for tokens in self.shard_tokens]
+        self.window_offsets = np.cumsum([0] + counts)
+        self.num_windows = int(self.window_offsets[-1])
+        assert self.num_windows >= self.B * self.num_processes, "not enough windows for one batch on every rank"
+
+    def _shuffle(self, epoch):
+        self.epoch = epoch
+        self.order = np.random.default_rng((self.seed, epoch)).permutation(self.num_windows)
+
+    def reset(self):
+        if self.shuffle:
+            self._shuffle(0)
+            self.current_batch = 0 #batches taken by all ranks together in this epoch
+            return
+    #state, init at shard 0
+        self.current_shard = 0
+        self.tokens = load_tokens(self.shards[self.current_shard])
+        self.current_position = self.B * self.T * self.process_rank 
+
+    def state_dict(self):
+        if self.shuffle:
+            return {'epoch': self.epoch, 'current_batch': self.current_batch}
+        # position is stored without the rank offset, so any rank can resume from the master's checkpoint
+        return {'current_shard': self.current_shard,
+                'current_position': self.current_position - self.B * self.T * self.process_rank}
+
+    def load_state_dict(self, state):
+        if self.shuffle:
+            self._shuffle(state['epoch'])
+            self.current_batch = state['current_batch']
+            return
+        self.current_shard = state['current_shard']
+        self.tokens = load_tokens(self.shards[self.current_shard])
+        self.current_position = state['current_position'] + self.B * self.T * self.process_rank
+
+    def _window(self, i):
+        shard = int(np.searchsorted(self.window_offsets, i, side='right')) - 1
+        j = i - self.window_offsets[shard]
+        start = int(self.window_starts[shard][j]) if self.align_docs else int(j) * self.T
+        return self.shard_tokens[shard][start:start + self.T + 1]
+
+    def _next_shuffled_batch(self):
+        B = self.B
+        per_batch = B * self.num_processes
+        if (self.current_batch + 1) * per_batch > self.num_windows:
+            self._shuffle(self.epoch + 1) #the last partial batch of the epoch is dropped
+            self.current_batch = 0
+        first = self.current_batch * per_batch + self.process_rank * B
+        buf = np.stack([self._window(i) for i in self.order[first:first + B]])
+        buf = torch.from_numpy(buf.astype(np.int64))
+        self.current_batch += 1
+        return buf[:, :-1].contiguous(), buf[:, 1:].contiguous()
+
+    def next_batch(self):
+        if self.shuffle:
+            return self._next_shuffled_batch()
+        B, T = self.B, self.T
+        buf = self.tokens[self.current_position:self.current_position + B*T+1]
+        buf = torch.from_numpy(buf.astype(np.int64)) #widen only this B*T+1 slice to torch.long
+        x = (buf[:-1]).view(B,T) #input
+        y = (buf[1:]).view(B,T) #targets
+        
+        self.current_position += B * T * self.num_processes
+
+        if self.current_position + (B * T * self.num_processes + 1) > len(self.tokens):
+            self.current_shard = (self.current_shard + 1) % len(self.shards)
+            self.tokens = load_tokens(self.shards[self.current_shard])
+            self.current_position = B * T * self.process_rank
+        return x, y
+
+
+class PrefetchLoader:
+    """
+    Runs a DataLoaderLite on a background thread that keeps up to `prefetch` batches ready
+    in a bounded queue of (pinned, when using cuda) buffers. A single worker walks the wrapped
+    loader, so batches come out in the same rank-strided order and shard switches happen
+    off the training thread.
+    """
+
+    def __init__(self, loader, prefetch=4, device='cpu'):
+        self.loader = loader
+        self.B = loader.B
+        self.T = loader.T
+        self.prefetch = prefetch
+        self.device = device
+        self.use_cuda = str(device).startswith('cuda')
+        #two spare buffers: one being filled by the worker, one being copied to the device
+        self.buffers = [
+            (torch.empty((self.B, self.T), dtype=torch.long, pin_memory=self.use_cuda),
+             torch.empty((self.B, self.T), dtype=torch.long, pin_memory=self.use_cuda))
+            for _ in range(prefetch + 2)
+        ]
+        self.copy_events = [None] * len(self.buffers) #cuda event of the last host to device copy out of each buffer
+        self._start()
+
+    def _start(self):
+        self.state = self.loader.state_dict() #position of the last batch handed out, not of the worker
+        self.ready = queue.Queue(maxsize=self.prefetch)
+        self.free = queue.Queue()
+        for i in range(len(self.buffers)):
+            self.free.put(i)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _worker(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    i = self.free.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if self.copy_events[i] is not None:
+                    self.copy_events[i].synchronize() #don't overwrite a buffer that is still being copied
+                x, y = self.loader.next_batch()
+                bx, by = self.buffers[i]
+                bx.copy_(x)
+                by.copy_(y)
+                state = self.loader.state_dict() #loader position right after this batch
+                self._put((i, state))
+        except Exception as e:
+            self._put(e) #surface the error on the training thread
+
+    def _put(self, item):
+        # waits for room in the ready queue, but gives up once the loader is stopped so _stop() can join
+        while not self.stop_event.is_set():
+            try:
+                self.ready.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def reset(self):
+        self._stop()
+        self.loader.reset()
+        self._start()
+
+    def state_dict(self):
+        return self.state
+
+    def load_state_dict(self, state):
+        self._stop()
+        self.loader.load_state_dict(state)
+        self._start()
+
+    def next_batch(self):
+        item = self.ready.get()
+        if isinstance(item, Exception):
+            raise item
+        i, self.state = item
+        bx, by = self.buffers[i]
+        if self.use_cuda:
+            x = bx.to(self.device, non_blocking=True)
+            y = by.to(self.device, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+            self.copy_events[i] = event
+        else:
+            x, y = bx.clone(), by.clone()
+        self.free.put(i)
+        return x, y
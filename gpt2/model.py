@@ -0,0 +1,422 @@
+"""
+GPT-2 model: attention/MLP blocks, the GPT module with its optimizer setup,
+and the KV cache and chunked lm_head loss it uses.
+"""
+from dataclasses import dataclass
+import inspect
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+from torch.utils.checkpoint import checkpoint
+#____________________________________________________________________________
+
+
+class CasualSelfAttention(nn.Module):
+
+    def __init__(self, config):
+        super().__init__()
+        assert config.n_embd % config.n_head == 0
+        self.c_attn = nn.Linear(config.n_embd, 3 * config.n_embd)
+        self.c_proj = nn.Linear(config.n_embd, config.n_embd)
+        self.c_proj.NANOGPT_SCALE_INIT = 1
+        self.n_head = config.n_head
+        self.n_embd = config.n_embd
+
+    def forward(self, x, kv_cache=None, layer=0):
+        B, T, C = x.size()
+        qkv = self.c_attn(x)
+        q, k, v = qkv.split(self.n_embd, dim=2)
+        k = k.view(B, T, self.n_head, C // self.n_head).transpose(1,2) # (B, nh, T, hs)
+        q = q.view(B, T, self.n_head, C // self.n_head).transpose(1,2) # (B, nh, T, hs)
+        v = v.view(B, T, self.n_head, C // self.n_head).transpose(1,2) # (B, nh, T, hs)
+
+        # att = (q @ k.transpose(-2,-1)) * (1.0 / math.sqrt(k.size(-1)))
+        # att = att.masked_fill(self.bias[:,:,:T,:T] == 0, float('-inf'))
+        # att = F.softmax(att, dim=-1)
+        # y = att @ v # (B,nh,T,T) x (B, nh, T, hs) -> (B,nh,T,hs)
+
+        if kv_cache is None:
+            y = F.scaled_dot_product_attention(q, k, v, is_causal=True) #flash attention
+        else:
+            #append the new keys/values and attend over everything cached so far
+            mask = kv_cache.attn_mask(T, x.device)
+            k, v = kv_cache.update(layer, k, v) # (B, nh, pos+T, hs)
+            if mask is None: #plain causal prefill, or a single query that sees every key
+                y = F.scaled_dot_product_attention(q, k, v, is_causal=(T > 1))
+            else:
+                y = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+
+        y = y.transpose(1,2).contiguous().view(B, T, C) # (B, T, C) basically the concat operation of differnt heads
+        y = self.c_proj(y)
+        return y
+    
+
+
+class MLP(nn.Module):
+
+    def __init__(self, config):
+        super().__init__()
+        self.c_fc = nn.Linear(config.n_embd, 4 * config.n_embd)
+        self.gelu = nn.GELU(approximate='tanh')
+        self.c_proj = nn.Linear(4 * config.n_embd, config.n_embd)
+        self.c_proj.NANOGPT_SCALE_INIT = 1
+
+    def forward(self, x):
+        x = self.c_fc(x)
+        x = self.gelu(x)
+        x = self.c_proj(x)
+        return x
+
+
+CHECKPOINT_MODES = ("none", "mlp", "block")
+
+class Block(nn.Module):
+    def __init__(self, config, checkpoint_activations="none"):
+        super().__init__()
+        self.ln_1 = nn.LayerNorm(config.n_embd)
+        self.attn = CasualSelfAttention(config)
+        self.ln_2 = nn.LayerNorm(config.n_embd)
+        self.mlp = MLP(config)
+        assert checkpoint_activations in CHECKPOINT_MODES, f"unknown activation checkpointing {checkpoint_activations}"
+        self.checkpoint_activations = checkpoint_activations
+
+    def _attn(self, x, kv_cache=None, layer=0):
+        return x + self.attn(self.ln_1(x), kv_cache, layer)
+
+    def _mlp(self, x):
+        return x + self.mlp(self.ln_2(x))
+
+    def _block(self, x):
+        return self._mlp(self._attn(x))
+
+    def forward(self, x, kv_cache=None, layer=0):
+        # activation checkpointing: drop the activations of the checkpointed part after the forward
+        # and recompute them in the backward, only when training (no cache, grads on)
+        mode = self.checkpoint_activations
+        if mode == "none" or kv_cache is not None or not torch.is_grad_enabled():
+            return self._mlp(self._attn(x, kv_cache, layer))
+        if mode == "block":
+            return checkpoint(self._block, x, use_reentrant=False)
+        return checkpoint(self._mlp, self._attn(x), use_reentrant=False) #"mlp", the 4*n_embd hidden activations are the largest
+
+
+class KVCache:
+    """
+    Preallocated per-layer key/value buffers for incremental decoding.
+    Each forward pass appends the keys/values of the new tokens at `pos`, so a decode
+    step only has to run the model on the newly sampled token instead of the whole sequence.
+    """
+
+    def __init__(self, config, batch_size, max_len=None, device='cpu'):
+        self.n_layer = config.n_layer
+        self.n_head = config.n_head
+        self.head_size = config.n_embd // config.n_head
+        self.batch_size = batch_size
+        self.max_len = max_len if max_len is not None else config.block_size
+        assert self.max_len <= config.block_size, f"KV cache of length {self.max_len} ,block size is only {config.block_size}"
+        self.device = device
+        self.k = None #allocated lazily so the buffers take the dtype of the keys (eg. bf16 under autocast)
+        self.v = None
+        self.pos = 0 #number of tokens already cached
+
+    def reset(self):
+        self.pos = 0
+
+    def positions(self, T, device):
+        # positions of the new tokens, used to index wpe
+        return torch.arange(self.pos, self.pos + T, dtype=torch.long, device=device)
+
+    def attn_mask(self, T, device):
+        # first chunk (prefill) is plain causal and a single new token sees everything,
+        # anything else needs queries at pos..pos+T-1 to see keys 0..pos+i
+        if self.pos == 0 or T == 1:
+            return None
+        return torch.ones(T, self.pos + T, dtype=torch.bool, device=device).tril(diagonal=self.pos)
+
+    def update(self, layer, k, v):
+        T = k.size(2)
+        assert self.pos + T <= self.max_len, f"KV cache overflow: {self.pos + T} > {self.max_len}"
+        if self.k is None:
+            shape = (self.n_layer, self.batch_size, self.n_head, self.max_len, self.head_size)
+            self.k = torch.empty(shape, dtype=k.dtype, device=self.device)
+            self.v = torch.empty(shape, dtype=v.dtype, device=self.device)
+        self.k[layer, :, :, self.pos:self.pos + T] = k
+        self.v[layer, :, :, self.pos:self.pos + T] = v
+        return self.k[layer, :, :, :self.pos + T], self.v[layer, :, :, :self.pos + T]
+
+    def advance(self, T):
+        self.pos += T
+
+    def rollback(self, pos):
+        # forget everything after the first `pos` tokens (eg. rejected speculative tokens), it gets overwritten
+        assert 0 <= pos <= self.pos, f"can't roll back to {pos}, only {self.pos} tokens cached"
+        self.pos = pos
+
+
+class SlotKVCache:
+    """
+    KV cache with a fixed number of slots that each hold an independent sequence of its own length,
+    for continuous batching. Before a forward pass `rows` selects the slots taking part:
+    either one slot with any number of new tokens (prefill), or any number of slots with
+    one new token each (decode). Queries only see the keys of their own slot.
+    """
+
+    def __init__(self, config, num_slots, max_len=None, device='cpu'):
+        self.n_layer = config.n_layer
+        self.n_head = config.n_head
+        self.head_size = config.n_embd // config.n_head
+        self.num_slots = num_slots
+        self.max_len = max_len if max_len is not None else config.block_size
+        assert self.max_len <= config.block_size, f"KV cache of length {self.max_len} ,block size is only {config.block_size}"
+        self.device = device
+        self.k = None
+        self.v = None
+        self.lengths = torch.zeros(num_slots, dtype=torch.long) #tokens cached per slot, kept on cpu
+        self.rows = torch.arange(num_slots)
+
+    def set_rows(self, rows):
+        self.rows = torch.as_tensor(rows, dtype=torch.long)
+
+    def reset(self, slot):
+        self.lengths[slot] = 0
+
+    def positions(self, T, device):
+        return (self.lengths[self.rows].unsqueeze(1) + torch.arange(T)).to(device) # (R, T)
+
+    def attn_mask(self, T, device):
+        # query i of row r is at position lengths[r] + i and sees keys up to there, padding beyond is masked
+        lengths = self.lengths[self.rows]
+        L = int(lengths.max()) + T
+        query_pos = lengths.unsqueeze(1) + torch.arange(T) # (R, T)
+        mask = torch.arange(L).view(1, 1, L) <= query_pos.unsqueeze(2) # (R, T, L)
+        return mask.unsqueeze(1).to(device) # (R, 1, T, L), broadcast over heads
+
+    def update(self, layer, k, v):
+        R, _, T, _ = k.size()
+        lengths = self.lengths[self.rows]
+        assert int(lengths.max()) + T <= self.max_len, f"KV cache overflow: {int(lengths.max()) + T} > {self.max_len}"
+        if self.k is None:
+            shape = (self.n_layer, self.num_slots, self.n_head, self.max_len, self.head_size)
+            #zeros, not empty: masked out padding still gets multiplied by 0 and must not be nan
+            self.k = torch.zeros(shape, dtype=k.dtype, device=self.device)
+            self.v = torch.zeros(shape, dtype=v.dtype, device=self.device)
+        rows = self.rows.to(self.device)
+        if T == 1:
+            pos = lengths.to(self.device)
+            self.k[layer][rows, :, pos] = k[:, :, 0]
+            self.v[layer][rows, :, pos] = v[:, :, 0]
+        else:
+            assert R == 1, "prefill one slot at a time"
+            start = int(lengths[0])
+            self.k[layer, rows[0], :, start:start + T] = k[0]
+            self.v[layer, rows[0], :, start:start + T] = v[0]
+        L = int(lengths.max()) + T
+        return self.k[layer][rows, :, :L], self.v[layer][rows, :, :L]
+
+    def advance(self, T):
+        self.lengths[self.rows] += T
+
+
+class ChunkedLMHeadLoss(torch.autograd.Function):
+    """
+    lm_head + mean cross entropy computed chunk_size tokens at a time. The gradients are worked
+    out chunk by chunk in the forward pass (the loss is a scalar at the end of the graph), so only
+    one (chunk_size, vocab_size) block of logits exists at a time and none are kept for backward.
+    """
+
+    @staticmethod
+    def forward(ctx, x, weight, targets, chunk_size, compute_grad):
+        N = x.size(0)
+        device_type = x.device.type
+        #do the autocast by hand: matmuls in the autocast dtype, softmax/loss in float32
+        if torch.is_autocast_enabled(device_type):
+            compute_dtype = torch.get_autocast_dtype(device_type)
+        else:
+            compute_dtype = x.dtype
+        with torch.autocast(device_type=device_type, enabled=False):
+            w = weight.to(compute_dtype)
+            loss = torch.zeros((), dtype=torch.float32, device=x.device)
+            grad_x = torch.empty(x.shape, dtype=torch.float32, device=x.device) if compute_grad else None
+            grad_w = torch.zeros(weight.shape, dtype=torch.float32, device=x.device) if compute_grad else None
+            for i in range(0, N, chunk_size):
+                x_c = x[i:i + chunk_size].to(compute_dtype)
+                t_c = targets[i:i + chunk_size]
+                logits = (x_c @ w.t()).float() #(chunk, vocab_size)
+                lse = torch.logsumexp(logits, dim=-1)
+                loss += (lse - logits.gather(1, t_c.unsqueeze(1)).squeeze(1)).sum()
+                if compute_grad:
+                    #d(loss)/d(logits) = (softmax - onehot) / N, computed in place of the logits
+                    probs = logits.sub_(lse.unsqueeze(1)).exp_()
+                    probs[torch.arange(t_c.size(0), device=x.device), t_c] -= 1.0
+                    probs = probs.div_(N).to(compute_dtype)
+                    grad_x[i:i + chunk_size] = probs @ w
+                    grad_w += probs.t() @ x_c
+        ctx.save_for_backward(grad_x, grad_w)
+        ctx.dtypes = (x.dtype, weight.dtype)
+        return loss / N
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad_x, grad_w = ctx.saved_tensors
+        x_dtype, w_dtype = ctx.dtypes
+        return (grad_x * grad_output).to(x_dtype), (grad_w * grad_output).to(w_dtype), None, None, None
+
+def chunked_cross_entropy(x, weight, targets, chunk_size):
+    # same as F.cross_entropy(x @ weight.t(), targets) without materializing the full logits
+    compute_grad = torch.is_grad_enabled() and (x.requires_grad or weight.requires_grad)
+    return ChunkedLMHeadLoss.apply(x, weight, targets, chunk_size, compute_grad)
+
+
+@dataclass
+class GPTConfig:
+    block_size: int = 1024 #max sequence length
+    vocab_size: int = 50257 #number of tokens: 50000 BPE merges + 256 byte tokens +1 special token which is endoftext
+    n_layer: int = 12 #number of layers
+    n_head: int = 12 #number of heads
+    n_embd: int = 768 #embedding dimensions
+    loss_chunk_size: int = 1024 #tokens per chunk of the fused lm_head + cross entropy loss, 0 to always build the full logits
+    checkpoint_activations: str = "none" #recompute activations in the backward: "none", "mlp" or "block"
+    checkpoint_every: int = 1 #apply it to every k-th block only (layers 0, k, 2k, ...)
+
+class GPT(nn.Module):
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+
+        self.transformer = nn.ModuleDict(dict(
+            wte = nn.Embedding(config.vocab_size, config.n_embd),
+            wpe = nn.Embedding(config.block_size, config.n_embd),
+            h = nn.ModuleList([Block(config, config.checkpoint_activations if i % config.checkpoint_every == 0 else "none")
+                               for i in range(config.n_layer)]),
+            ln_f = nn.LayerNorm(config.n_embd),
+        ))
+
+        self.lm_head = nn.Linear(config.n_embd, config.vocab_size, bias=False)
+
+        #Weight sharing scheme
+        self.transformer.wte.weight = self.lm_head.weight
+
+        # init params
+        self.apply(self._init_weights)
+
+    def _init_weights(self, module):
+        if isinstance(module, nn.Linear):
+            std = 0.02
+            if hasattr(module, 'NANOGPT_SCALE_INIT'):
+                std *= (2 * self.config.n_layer) ** -0.5
+            torch.nn.init.normal_(module.weight, mean = 0.0, std=std)
+            if module.bias is not None:
+                torch.nn.init.zeros_(module.bias)
+        elif isinstance(module, nn.Embedding):
+            torch.nn.init.normal_(module.weight, mean=0.0, std=0.02)
+
+    def forward(self, idx, targets=None, kv_cache=None, return_logits=False):
+        B, T = idx.size()
+        assert T <=self.config.block_size, f"Cannot forward sequence of length {T} ,block size is only {self.config.block_size}"
+
+        if kv_cache is None:
+            pos = torch.arange(0, T, dtype=torch.long, device=idx.device)
+        else:
+            pos = kv_cache.positions(T, idx.device) #offset by what is already cached, the cache checks block_size
+        pos_emb = self.transformer.wpe(pos)
+        tok_emb = self.transformer.wte(idx)
+        x = tok_emb + pos_emb
+
+        for i, block in enumerate(self.transformer.h):
+            x = block(x, kv_cache, i)
+        if kv_cache is not None:
+            kv_cache.advance(T)
+
+        x = self.transformer.ln_f(x)
+        if targets is not None and not return_logits and self.config.loss_chunk_size > 0:
+            #training/validation only need the loss, so skip the (B, T, vocab_size) logits
+            loss = chunked_cross_entropy(x.view(-1, x.size(-1)), self.lm_head.weight, targets.view(-1), self.config.loss_chunk_size)
+            return None, loss
+        logits = self.lm_head(x) #(B, T, vocab_size)
+        loss = None
+        if targets is not None:
+            loss = F.cross_entropy(logits.view(-1, logits.size(-1)), targets.view(-1))
+        
+        return logits, loss
+    
+    @classmethod
+    def from_pretrained(cls, model_type):
+        assert model_type in {'gpt2', 'gpt2-medium', 'gpt2-large','gpt2-xl'}
+        from transformers import GPT2LMHeadModel
+        print("loading weights from pretrained gpt: %s" %model_type)
+
+        config_args = {
+            'gpt2':         dict(n_layer=12, n_head=12, n_embd=768),  # 124M params
+            'gpt2-medium':  dict(n_layer=24, n_head=16, n_embd=1024), # 350M params
+            'gpt2-large':   dict(n_layer=36, n_head=20, n_embd=1280), # 774M params
+            'gpt2-xl':      dict(n_layer=48, n_head=25, n_embd=1600), # 1558M params
+        }[model_type]
+        config_args['vocab_size'] = 50257
+        config_args['block_size'] =1024
+
+        # create a from-scratch initialized minGPT model
+        config = GPTConfig(**config_args)
+        model = GPT(config)
+        sd = model.state_dict()
+        sd_keys = sd.keys()
+        sd_keys = [k for k in sd_keys if not k.endswith('.attn.bias')] # discard this mask / buffer, not a param
+         
+        #for build hugging face model
+        model_hf = GPT2LMHeadModel.from_pretrained(model_type)
+        sd_hf = model_hf.state_dict()
+        sd_keys_hf = sd_hf.keys()
+
+        sd_keys_hf = [k for k in sd_keys_hf if not k.endswith('.attn.masked_bias')] #  just a buffer
+        sd_keys_hf = [k for k in sd_keys_hf if not k.endswith('.attn.bias')] #  just the mask (buffer)
+        #we need to transpose some weight matrix since it strored in (out,in) format in hf model because its using conv1D.
+        #so after transpose we will get those weight matrixes as (input,output) which is in pytorch format.
+        transposed = ['attn.c_attn.weight', 'attn.c_proj.weight', 'mlp.c_fc.weight', 'mlp.c_proj.weight']
+        assert len(sd_keys_hf) == len(sd_keys), f"mismatched keys: {len(sd_keys_hf)} != {len(sd_keys)}"
+        for k in sd_keys_hf:
+            if any(k.endswith(w) for w in transposed):
+                assert sd_hf[k].shape[::-1] == sd[k].shape
+                with torch.no_grad():
+                    sd[k].copy_(sd_hf[k].t())
+            else:
+                assert sd_hf[k].shape == sd[k].shape
+                with torch.no_grad():
+                    sd[k].copy_(sd_hf[k])
+        
+        return model
+    
+    def flops_per_token(self, T):
+        # training flops per token (forward + backward) as in the PaLM paper appendix B:
+        # 6 per parameter for the matmuls plus the attention scores over a T long context
+        cfg = self.config
+        N = sum(p.numel() for p in self.parameters()) - self.transformer.wpe.weight.numel()
+        return 6 * N + 12 * cfg.n_layer * cfg.n_embd * T
+
+    def configure_optimizers(self, weight_decay, learning_rate, device_type, verbose=True, zero=False, fused=None):
+       #taking all candidate parameters that require grad
+        param_dict = {pn:p for pn, p in self.named_parameters()}
+        param_dict = {pn:p for pn, p in param_dict.items() if p.requires_grad}
+        #creating Optim groups that any parameters that 2D will be weight decayed, otherwise no.
+        decay_params = [p for n, p in param_dict.items() if p.dim() >= 2]
+        nodecay_params = [p for n, p in param_dict.items() if p.dim() < 2]
+        optim_groups = [{'params':decay_params, ' weight_decay': weight_decay},
+                       {'params':nodecay_params, 'weight_decay': 0.0}
+                       ]
+        num_decay_params = sum(p.numel() for p in decay_params)  
+        num_nodecay_params = sum(p.numel() for p in nodecay_params) 
+        if verbose:
+            print(f"num decayed parameters tensors: {len(decay_params)}, with{num_decay_params}:parameters")
+            print(f"num non-decayed parameter tensors: {len(nodecay_params)}, with {num_nodecay_params:,} parameters")
+        # Create AdamW optimizer and use the fused version if it is available
+        fused_available = 'fused' in inspect.signature(torch.optim.AdamW).parameters
+        use_fused = fused_available and device_type == "cuda"    #Kernal fusion for optimizer calculations
+        if fused is not None: #forced on or off, eg. by bench_suite.py (recent torch also has a fused cpu kernel)
+            use_fused = fused_available and fused
+        if verbose:
+            print(f"using fused AdamW: {use_fused}")
+        if zero:
+            #ZeRO-1, each ddp rank keeps the AdamW state of only its share of the parameters (needs an initialized process group)
+            from torch.distributed.optim import ZeroRedundancyOptimizer
+            optimizer = ZeroRedundancyOptimizer(optim_groups, optimizer_class=torch.optim.AdamW, lr=learning_rate, betas=(0.9,0.95), eps=1e-8, fused=use_fused)
+        else:
+            optimizer = torch.optim.AdamW(optim_groups, lr=learning_rate, betas=(0.9,0.95), eps=1e-8, fused=use_fused)
+        return optimizer
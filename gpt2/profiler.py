@@ -0,0 +1,87 @@
+"""
+Training step metrics (time, tok/sec, MFU, peak memory) written as one JSON line per step,
+with an optional per-phase breakdown. Phases are timed with phase("name") blocks; on cuda the
+device is synchronized at phase boundaries so kernel time is charged to the phase that
+launched it (this removes some overlap, so only turn it on when you want the breakdown).
+When phase timing is disabled, phase() returns a shared no-op context and nothing is synchronized.
+An optional torch.profiler trace can be captured for a window of steps.
+"""
+import os
+import json
+import time
+import resource
+import contextlib
+import torch
+#_______________________________________________________________________________
+
+class _Phase:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._sync()
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler._sync()
+        times = self.profiler.times
+        times[self.name] = times.get(self.name, 0.0) + time.perf_counter() - self.t0
+
+
+class StepProfiler:
+
+    def __init__(self, log_path=None, enabled=True, device_type='cpu', flops_per_token=None, peak_flops=312e12,
+                 trace_steps=None, trace_dir=None, rank=0, world_size=1):
+        self.log_path = log_path
+        self.enabled = enabled
+        self.device_type = device_type
+        self.flops_per_token = flops_per_token #from GPT.flops_per_token, for MFU
+        self.peak_flops = peak_flops #of one device, A100 bf16 by default
+        self.world_size = world_size #tokens passed to end_step are summed over all ranks, so MFU divides by every device
+        self.trace_steps = trace_steps #(first, last) step of a torch.profiler trace, None for no trace
+        self.trace_dir = trace_dir
+        self.rank = rank #every ddp rank writes its own trace file
+        self.trace = None
+        self.times = {}
+        self._null = contextlib.nullcontext()
+
+    def _sync(self):
+        if self.device_type == 'cuda':
+            torch.cuda.synchronize()
+
+    def phase(self, name):
+        if not self.enabled:
+            return self._null
+        return _Phase(self, name)
+
+    def start_step(self, step):
+        self.times = {}
+        if self.device_type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+        if self.trace_steps is not None and step == self.trace_steps[0]:
+            self.trace = torch.profiler.profile(record_shapes=True, profile_memory=True, with_stack=True)
+            self.trace.__enter__()
+
+    def end_step(self, step, dt, tokens, **metrics):
+        """Finishes the step that took dt seconds for `tokens` tokens (of all ranks) and returns its metrics."""
+        if self.trace is not None and step == self.trace_steps[1]:
+            self.trace.__exit__(None, None, None)
+            os.makedirs(self.trace_dir, exist_ok=True)
+            self.trace.export_chrome_trace(os.path.join(self.trace_dir, f"trace_{self.trace_steps[0]}_{step}_rank{self.rank}.json"))
+            self.trace = None
+        tokens_per_sec = tokens / dt
+        record = {'step': step, **metrics, 'dt_ms': dt * 1000, 'tok_per_sec': tokens_per_sec}
+        if self.flops_per_token is not None:
+            record['mfu'] = self.flops_per_token * tokens_per_sec / (self.peak_flops * self.world_size)
+        if self.device_type == 'cuda':
+            record['peak_mem_mb'] = torch.cuda.max_memory_allocated() / 2**20
+        else:
+            record['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 #process lifetime peak on cpu
+        if self.enabled:
+            record['phases_ms'] = {k: v * 1000 for k, v in self.times.items()}
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
@@ -0,0 +1,132 @@
+"""
+Int8 weight-only quantization for cpu inference.
+Every nn.Linear in the blocks and the lm_head gets int8 weights with one float scale per
+output channel (symmetric, absmax/127). The token embedding shares the lm_head's int8
+weights and scales, same as the float model ties wte and lm_head. Matmul modes:
+- 'int8pack' (default): torch's weight-only int8 kernel with bf16 activations
+- 'dequant': float activations times the weights converted back to float, the most exact
+- 'int_mm': opt-in W8A8, activations are also quantized to int8 per token on the fly and
+  multiplied with torch._int_mm (int32 accumulation), the fastest on cpu but no longer weight-only
+
+python -m gpt2.quantize log/gpt2_124M.pt gpt2_124M_int8.pt
+"""
+import os
+from dataclasses import asdict
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+from gpt2.model import GPT, GPTConfig
+#_______________________________________________________________________________
+
+MODES = ('int8pack', 'dequant', 'int_mm')
+DEFAULT_MODE = 'int8pack'
+
+def quantize_weight(weight):
+    # per output channel symmetric int8, returns (int8 weight, float32 scale)
+    weight = weight.detach().float()
+    scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127.0
+    weight_int8 = torch.round(weight / scale.unsqueeze(1)).clamp(-127, 127).to(torch.int8)
+    return weight_int8, scale
+
+
+class Int8Linear(nn.Module):
+
+    def __init__(self, in_features, out_features, bias=True, mode=DEFAULT_MODE):
+        super().__init__()
+        assert mode in MODES, f"unknown int8 matmul mode {mode}"
+        self.in_features = in_features
+        self.out_features = out_features
+        self.mode = mode
+        self.register_buffer('weight_int8', torch.zeros((out_features, in_features), dtype=torch.int8))
+        self.register_buffer('scale', torch.ones(out_features, dtype=torch.float32))
+        self.register_buffer('bias', torch.zeros(out_features) if bias else None)
+
+    @classmethod
+    def from_linear(cls, linear, mode=DEFAULT_MODE):
+        module = cls(linear.in_features, linear.out_features, linear.bias is not None, mode)
+        module.weight_int8, module.scale = quantize_weight(linear.weight)
+        if linear.bias is not None:
+            module.bias = linear.bias.detach().float().clone()
+        return module
+
+    @property
+    def weight(self):
+        # dequantized weight, for code that needs the full matrix (eg. the chunked loss)
+        return self.weight_int8.float() * self.scale.unsqueeze(1)
+
+    def forward(self, x):
+        shape = x.shape
+        if self.mode == 'int_mm':
+            x2 = x.reshape(-1, shape[-1]).float()
+            x_scale = x2.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127.0 #per token
+            x_int8 = torch.round(x2 / x_scale).to(torch.int8)
+            y = torch._int_mm(x_int8, self.weight_int8.t()).float() * x_scale * self.scale
+            y = y.view(*shape[:-1], self.out_features).to(x.dtype)
+        elif self.mode == 'int8pack':
+            x2 = x.reshape(-1, shape[-1]).to(torch.bfloat16)
+            y = torch.ops.aten._weight_int8pack_mm(x2, self.weight_int8, self.scale.to(torch.bfloat16))
+            y = y.view(*shape[:-1], self.out_features).to(x.dtype)
+        else:
+            #scale per output channel, so it can be applied after the matmul
+            y = F.linear(x, self.weight_int8.to(x.dtype)) * self.scale.to(x.dtype)
+        if self.bias is not None:
+            y = y + self.bias.to(x.dtype)
+        return y
+
+
+class Int8Embedding(nn.Module):
+
+    def __init__(self, num_embeddings, embedding_dim):
+        super().__init__()
+        self.register_buffer('weight_int8', torch.zeros((num_embeddings, embedding_dim), dtype=torch.int8))
+        self.register_buffer('scale', torch.ones(num_embeddings, dtype=torch.float32))
+
+    def forward(self, idx):
+        return self.weight_int8[idx].float() * self.scale[idx].unsqueeze(-1)
+
+
+def quantize_model(model, mode=DEFAULT_MODE):
+    """Swaps the Linear layers and the tied wte/lm_head of a GPT for int8 versions, in place."""
+    for block in model.transformer.h:
+        block.attn.c_attn = Int8Linear.from_linear(block.attn.c_attn, mode)
+        block.attn.c_proj = Int8Linear.from_linear(block.attn.c_proj, mode)
+        block.mlp.c_fc = Int8Linear.from_linear(block.mlp.c_fc, mode)
+        block.mlp.c_proj = Int8Linear.from_linear(block.mlp.c_proj, mode)
+    model.lm_head = Int8Linear.from_linear(model.lm_head, mode)
+    wte = Int8Embedding(model.config.vocab_size, model.config.n_embd)
+    wte.weight_int8 = model.lm_head.weight_int8 #weight sharing, same tensors
+    wte.scale = model.lm_head.scale
+    model.transformer.wte = wte
+    return model
+
+def save_quantized(model, path):
+    model = getattr(model, '_orig_mod', model)
+    tmp_path = path + ".tmp"
+    torch.save({'config': asdict(model.config), 'quantization': 'int8', 'model': model.state_dict()}, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_quantized(path, device='cpu', mode=DEFAULT_MODE, checkpoint=None):
+    if checkpoint is None:
+        checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    assert checkpoint.get('quantization') == 'int8', f"{path} is not an int8 quantized model"
+    config = GPTConfig(**checkpoint['config'])
+    with torch.device('meta'):
+        model = quantize_model(GPT(config), mode)
+    model.load_state_dict(checkpoint['model'], assign=True)
+    model.transformer.wte.weight_int8 = model.lm_head.weight_int8 #assign=True loaded two copies of the shared tensors
+    model.transformer.wte.scale = model.lm_head.scale
+    model.to(device)
+    model.eval()
+    return model
+
+
+if __name__ == "__main__":
+    import argparse
+    from gpt2.weights import load_inference
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", type=str, help="inference weights file written by gpt2.weights")
+    parser.add_argument("out", type=str)
+    args = parser.parse_args()
+    model = load_inference(args.model)
+    save_quantized(quantize_model(model.float()), args.out)
+    print(f"wrote {args.out}")
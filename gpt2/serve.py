@@ -0,0 +1,293 @@
+"""
+Continuous-batching inference over a stream of JSONL requests.
+Requests with different prompt lengths, sampling parameters and stop conditions share one
+batch: each decode step runs one token for every running request, finished requests free
+their KV cache slot right away and waiting requests are prefilled into it.
+
+One request per line on stdin (or --input), one result per line on stdout:
+{"id": "a", "prompt": "Hello, I'm a language model,", "max_new_tokens": 64, "temperature": 0.8, "top_k": 50, "stop": ["\n"]}
+python -m gpt2.serve --pretrained gpt2 --max_batch 16 < prompts.jsonl > results.jsonl
+Per-request latency is in each result, aggregate tokens/sec is printed to stderr at the end.
+A line that isn't a valid request gets a {"id": ..., "error": ...} result and the others carry on.
+"""
+import sys
+import json
+import time
+import queue
+import threading
+import collections
+from dataclasses import dataclass, field
+import torch
+from torch.nn import functional as F
+from gpt2.model import SlotKVCache
+#_______________________________________________________________________________
+
+EOT = 50256 #<|endoftext|>
+#the keys a JSONL request may have and their types
+REQUEST_FIELDS = {'id': (str, int), 'prompt': str, 'prompt_tokens': list, 'max_new_tokens': int, 'temperature': (int, float),
+                  'top_k': int, 'stop': list, 'stop_tokens': list, 'seed': int}
+#the type of the elements of the list fields
+REQUEST_ELEMENTS = {'prompt_tokens': int, 'stop': str, 'stop_tokens': int}
+
+class RequestError(ValueError):
+    """An invalid request, answered with an error result instead of stopping the engine."""
+
+    def __init__(self, id, message):
+        super().__init__(message)
+        self.id = id
+
+@dataclass
+class GenerationRequest:
+    id: str
+    prompt_tokens: list
+    max_new_tokens: int = 32
+    temperature: float = 1.0 #0 for greedy decoding
+    top_k: int = 50 #0 to sample from the full distribution
+    stop: list = field(default_factory=list) #stop strings, need the engine to have a decode function
+    stop_tokens: list = field(default_factory=lambda: [EOT])
+    seed: int = 42
+    #filled in by the engine
+    generator: torch.Generator = None
+    tokens: list = field(default_factory=list)
+    finish_reason: str = None
+    submit_time: float = 0.0
+    first_token_time: float = 0.0
+    finish_time: float = 0.0
+
+    def result(self, decode=None):
+        latency = self.finish_time - self.submit_time
+        out = {
+            'id': self.id,
+            'tokens': self.tokens,
+            'finish_reason': self.finish_reason,
+            'num_prompt_tokens': len(self.prompt_tokens),
+            'num_tokens': len(self.tokens),
+            'latency_ms': latency * 1000,
+            'ttft_ms': (self.first_token_time - self.submit_time) * 1000,
+            'tok_per_sec': len(self.tokens) / latency if latency > 0 else 0.0,
+        }
+        if decode is not None:
+            text = decode(self.tokens)
+            for s in self.stop:
+                if s in text:
+                    text = text[:text.index(s)]
+            out['text'] = text
+        return out
+
+
+class InferenceEngine:
+    """
+    Schedules GenerationRequests over a SlotKVCache with max_batch slots.
+    Call submit() any time and step() in a loop, step() returns the requests that finished.
+    Every request samples from its own seeded generator, so its output doesn't depend on
+    what else happens to be in the batch.
+    """
+
+    def __init__(self, model, max_batch=8, max_len=None, device='cpu', decode=None):
+        self.model = model
+        self.device = device
+        self.decode = decode
+        config = getattr(model, '_orig_mod', model).config
+        self.max_len = max_len if max_len is not None else config.block_size
+        self.cache = SlotKVCache(config, max_batch, self.max_len, device)
+        self.free_slots = list(range(max_batch))[::-1]
+        self.active = {} #slot -> request, each has exactly one sampled token not yet in the cache
+        self.waiting = collections.deque()
+        self.num_generated = 0
+
+    def submit(self, request):
+        vocab_size = getattr(self.model, '_orig_mod', self.model).config.vocab_size
+        if len(request.prompt_tokens) == 0:
+            raise RequestError(request.id, "empty prompt")
+        if not all(isinstance(t, int) and 0 <= t < vocab_size for t in request.prompt_tokens):
+            raise RequestError(request.id, f"prompt tokens must be integers in [0, {vocab_size})")
+        if request.max_new_tokens < 1:
+            raise RequestError(request.id, "max_new_tokens must be at least 1")
+        if request.temperature < 0 or request.top_k < 0:
+            raise RequestError(request.id, "temperature and top_k can't be negative")
+        request.submit_time = time.time()
+        #keep the end of prompts that wouldn't leave room for a single new token
+        request.prompt_tokens = request.prompt_tokens[-(self.max_len - 1):]
+        request.generator = torch.Generator().manual_seed(request.seed)
+        self.waiting.append(request)
+
+    def has_work(self):
+        return bool(self.waiting or self.active)
+
+    @torch.no_grad()
+    def step(self):
+        finished = []
+        #admit waiting requests into free slots, the prompt is prefilled on its own
+        while self.waiting and self.free_slots:
+            request = self.waiting.popleft()
+            slot = self.free_slots.pop()
+            self.cache.reset(slot)
+            self.cache.set_rows([slot])
+            idx = torch.tensor([request.prompt_tokens], dtype=torch.long, device=self.device)
+            logits, _ = self.model(idx, kv_cache=self.cache)
+            token = self._sample(logits[:, -1, :], [request])[0]
+            request.first_token_time = time.time()
+            if self._append(request, token):
+                finished.append(request)
+                self.free_slots.append(slot)
+            else:
+                self.active[slot] = request
+        #one decode step over every running request
+        if self.active:
+            slots = list(self.active)
+            requests = [self.active[s] for s in slots]
+            self.cache.set_rows(slots)
+            idx = torch.tensor([[r.tokens[-1]] for r in requests], dtype=torch.long, device=self.device)
+            logits, _ = self.model(idx, kv_cache=self.cache)
+            tokens = self._sample(logits[:, -1, :], requests)
+            for slot, request, token in zip(slots, requests, tokens):
+                if self._append(request, token):
+                    finished.append(request)
+                    del self.active[slot]
+                    self.free_slots.append(slot)
+        return finished
+
+    def _sample(self, logits, requests):
+        logits = logits.float().cpu() #the per-request generators live on the cpu
+        tokens = []
+        for row, request in zip(logits, requests):
+            if request.temperature == 0:
+                tokens.append(int(row.argmax()))
+                continue
+            probs = F.softmax(row / request.temperature, dim=-1)
+            if request.top_k > 0:
+                topk_probs, topk_indices = torch.topk(probs, min(request.top_k, probs.size(-1)))
+                ix = torch.multinomial(topk_probs, 1, generator=request.generator)
+                tokens.append(int(topk_indices[ix]))
+            else:
+                tokens.append(int(torch.multinomial(probs, 1, generator=request.generator)))
+        return tokens
+
+    def _append(self, request, token):
+        # returns True once the request is done
+        if token in request.stop_tokens:
+            request.finish_reason = 'stop'
+        else:
+            request.tokens.append(token)
+            self.num_generated += 1
+            if request.stop and self.decode is not None and any(s in self.decode(request.tokens) for s in request.stop):
+                request.finish_reason = 'stop'
+            elif len(request.tokens) >= request.max_new_tokens:
+                request.finish_reason = 'length'
+            elif len(request.prompt_tokens) + len(request.tokens) >= self.max_len:
+                request.finish_reason = 'length' #no room left in the cache for the last token
+        if request.finish_reason is None:
+            return False
+        request.finish_time = time.time()
+        request.generator = None
+        return True
+
+#_______________________________________________________________________________
+
+def parse_request(line, encode, n):
+    # raises RequestError for anything that isn't a request, n is the id of requests without one
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise RequestError(str(n), f"invalid json: {e}")
+    if not isinstance(data, dict):
+        raise RequestError(str(n), "a request must be a json object")
+    id = str(data.setdefault('id', str(n)))
+    unknown = sorted(set(data) - set(REQUEST_FIELDS))
+    if unknown:
+        raise RequestError(id, f"unknown fields {unknown}, expected some of {sorted(REQUEST_FIELDS)}")
+    for key, value in data.items():
+        if isinstance(value, bool) or not isinstance(value, REQUEST_FIELDS[key]): #bool is an int subclass, but true isn't 1 token
+            raise RequestError(id, f"wrong type {type(value).__name__} for {key}")
+        if key in REQUEST_ELEMENTS:
+            for v in value:
+                if isinstance(v, bool) or not isinstance(v, REQUEST_ELEMENTS[key]):
+                    raise RequestError(id, f"wrong type {type(v).__name__} in {key}, expected {REQUEST_ELEMENTS[key].__name__}")
+    data['id'] = id
+    prompt_tokens = data.pop('prompt_tokens', None)
+    prompt = data.pop('prompt', None)
+    if prompt_tokens is None:
+        if prompt is None:
+            raise RequestError(id, "no prompt or prompt_tokens")
+        prompt_tokens = encode(prompt)
+    return GenerationRequest(prompt_tokens=prompt_tokens, **data)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def serve(engine, lines, out, encode, decode=None):
+    """
+    Feeds JSONL requests from `lines` into the engine as they arrive (a reader thread keeps
+    reading while the engine is busy) and writes a JSONL result for every finished request.
+    Returns the list of results.
+    """
+    incoming = queue.Queue()
+    def reader():
+        for line in lines:
+            if line.strip():
+                incoming.put(line)
+        incoming.put(None)
+    threading.Thread(target=reader, daemon=True).start()
+
+    results = []
+    def write(result):
+        results.append(result)
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    n = 0
+    eof = False
+    t0 = time.time()
+    while not eof or engine.has_work():
+        #block for input only when there is nothing to run
+        while not eof:
+            try:
+                line = incoming.get(block=not engine.has_work())
+            except queue.Empty:
+                break
+            if line is None:
+                eof = True
+            else:
+                try:
+                    engine.submit(parse_request(line, encode, n))
+                except RequestError as e:
+                    write({'id': e.id, 'error': str(e)})
+                n += 1
+        for request in engine.step():
+            write(request.result(decode))
+    dt = time.time() - t0
+    latencies = [r['latency_ms'] for r in results if 'error' not in r]
+    if latencies:
+        num_errors = len(results) - len(latencies)
+        print(f"requests: {len(latencies)} | errors: {num_errors} | generated tokens: {engine.num_generated} | time: {dt:.2f}s | "
+              f"tok/sec: {engine.num_generated / dt:.1f} | latency p50: {percentile(latencies, 0.5):.1f}ms "
+              f"p90: {percentile(latencies, 0.9):.1f}ms", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import tiktoken
+    from gpt2.model import GPT, GPTConfig
+    from gpt2.weights import load_inference, load_pretrained
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", type=str, default=None, help="inference weights file written by gpt2.weights")
+    parser.add_argument("-p", "--pretrained", type=str, default=None, help="HF model type to load instead, eg. gpt2")
+    parser.add_argument("-i", "--input", type=str, default=None, help="JSONL requests, stdin by default")
+    parser.add_argument("--max_batch", type=int, default=8)
+    parser.add_argument("--max_len", type=int, default=None)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    if args.model is not None:
+        model = load_inference(args.model, device=args.device)
+    elif args.pretrained is not None:
+        model = load_pretrained(args.pretrained, device=args.device)
+    else:
+        print("no weights given, serving a randomly initialized model", file=sys.stderr)
+        model = GPT(GPTConfig(vocab_size=50304)).to(args.device).eval()
+    enc = tiktoken.get_encoding('gpt2')
+    engine = InferenceEngine(model, max_batch=args.max_batch, max_len=args.max_len, device=args.device, decode=enc.decode)
+    lines = open(args.input) if args.input is not None else sys.stdin
+    serve(engine, lines, sys.stdout, encode=enc.encode_ordinary, decode=enc.decode)
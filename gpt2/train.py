@@ -0,0 +1,358 @@
+"""
+Training entry point, run with
+python -m gpt2.train
+or for ddp (nccl on gpus, gloo on cpu-only machines)
+torchrun --standalone --nproc_per_node=8 -m gpt2.train
+Any TrainConfig field can be set on the command line, eg.
+torchrun --standalone --nproc_per_node=2 -m gpt2.train --zero --use_compile false --n_layer 2
+"""
+import math
+import os
+import time
+import argparse
+from dataclasses import dataclass, fields
+import numpy as np
+import torch
+from torch.distributed import init_process_group, destroy_process_group
+from torch.nn.parallel import DistributedDataParallel as DDP
+import torch.distributed as dist
+from gpt2.model import GPT, GPTConfig
+from gpt2.data import DataLoaderLite, PrefetchLoader
+from gpt2.checkpoint import CheckpointWriter, list_checkpoints
+from gpt2.profiler import StepProfiler
+#_______________________________________________________________________________
+
+@dataclass
+class TrainConfig:
+    total_batch_size: int = 524288 # 2**19, ~0.5M, in number of tokens.Batch size in gpt2 paper = 524288
+    B: int = 64 #4/16/64 #micro batch size
+    T: int = 1024 #32/1024 #sequence length
+    #model
+    block_size: int = 1024
+    n_layer: int = 12
+    n_head: int = 12
+    n_embd: int = 768
+    checkpoint_activations: str = "none" #"mlp" or "block" recompute activations in the backward so a larger B fits
+    checkpoint_every: int = 1 #only checkpoint every k-th block
+    vocab_size: int = 50304 #Changed vocab_size fro 50257 to 50304 for optimization and efficencysince it is a power of 2
+    #optimization
+    max_lr: float = 6e-4
+    min_lr_ratio: float = 0.1
+    warmup_steps: int = 715
+    max_steps: int = 19073 #we are doing 524288 tokens per step and we have 10B token.so 10B/524288 = 19073
+    weight_decay: float = 0.1
+    zero: bool = False #ZeRO-1: shard the AdamW state over the ddp ranks instead of keeping a full copy on each
+    use_compile: bool = True #ON and OFF point of torch.compile
+    autocast: bool = True #bf16 mixed precision
+    seed: int = 1337
+    #data
+    data_root: str = "edu_fineweb10B"
+    shuffle: bool = False #random windows from all train shards, reshuffled every epoch, instead of reading them in order
+    align_docs: bool = False #with shuffle, start every window at a document
+    prefetch: int = 4 #number of batches prepared ahead by a background thread, 0 to load on the training thread
+    #evaluation, an interval of 0 turns it off
+    val_every: int = 350
+    val_loss_steps: int = 20
+    hella_every: int = 250
+    hella_batch_size: int = 8 #HellaSwag examples per forward pass (4 rows each)
+    #logging and checkpoints
+    log_dir: str = "log"
+    keep_last: int = 3 #keep only the 3 newest checkpoints
+    resume: bool = True #continue from the newest checkpoint in log_dir if there is one
+    profile: bool = False #True also times each phase (data, h2d, forward, backward, ...), adds a device sync per phase. With prefetch > 0 on cuda the loader already copies to the device inside "data", so "h2d" stays ~0
+    trace_steps: str = "" #eg. "10,15" to also write a torch.profiler chrome trace of steps 10..15 to log_dir (one file per rank)
+    peak_flops: float = 312e12 #peak flops/sec of one device for the logged MFU, A100 bf16 by default, set it for other hardware
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    for f in fields(TrainConfig):
+        if f.type is bool:
+            parser.add_argument(f"--{f.name}", type=lambda s: s.lower() in ('1', 'true', 'yes'), nargs='?', const=True, default=f.default)
+        else:
+            parser.add_argument(f"--{f.name}", type=f.type, default=f.default)
+    return TrainConfig(**vars(parser.parse_args(argv)))
+
+def optimizer_state_bytes(optimizer):
+    # bytes of AdamW state held by this rank, only the local shard under ZeRO
+    optimizer = getattr(optimizer, 'optim', optimizer)
+    return sum(t.numel() * t.element_size() for s in optimizer.state.values() for t in s.values() if torch.is_tensor(t))
+
+def main(cfg=None):
+    cfg = cfg if cfg is not None else TrainConfig()
+
+    #Setting up DDP
+    #torchrun command sets the env variables RANK, LOCAL_RANK, and WORLD_SIZE
+    ddp = int(os.environ.get('RANK', -1)) != -1 #will be True if ddp run
+    if ddp:
+        ddp_rank = int(os.environ['RANK'])
+        ddp_local_rank = int(os.environ['LOCAL_RANK'])
+        ddp_world_size = int(os.environ['WORLD_SIZE'])
+        if torch.cuda.is_available():
+            init_process_group(backend='nccl')
+            device = f"cuda:{ddp_local_rank}"
+            torch.cuda.set_device(device)
+        else:
+            init_process_group(backend='gloo') #cpu-only machines, each process trains on the cpu
+            device = 'cpu'
+        master_process = ddp_rank == 0 #this is the process doing checkpoint,logging,etc
+    else:
+        ddp_rank = 0
+        ddp_local_rank = 0
+        ddp_world_size = 1
+        master_process = True
+        #attempt to autodetect the device
+        device = 'cpu'
+        if torch.cuda.is_available():
+            device = 'cuda'
+        elif hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+            device = "mps"  #for mac users use apple silicon cpu which allready have gpu.mps is backend for apple silicon
+        print(f"Using device: {device}")
+    # device = "cpu" #OVERRIDE
+
+    device_type = "cuda" if device.startswith("cuda") else "cpu"
+
+    torch.manual_seed(cfg.seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed(cfg.seed)
+
+    total_batch_size = cfg.total_batch_size
+    B, T = cfg.B, cfg.T
+    assert total_batch_size % (B * T * ddp_world_size) == 0 #confirmimg total_batch_size is divisible by B * T * ddp_worldsize
+    grad_accum_steps = total_batch_size // (B * T * ddp_world_size)
+    if master_process:
+        print(f"total desired batch size: {total_batch_size}")
+        print(f"=> calculated gradient accumulation steps: {grad_accum_steps}")
+
+    train_loader = DataLoaderLite(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="train", data_root=cfg.data_root, verbose=master_process, #(4,32)/(16,1024)
+                                  shuffle=cfg.shuffle, align_docs=cfg.align_docs, seed=cfg.seed)
+    if cfg.prefetch > 0:
+        train_loader = PrefetchLoader(train_loader, prefetch=cfg.prefetch, device=device)
+    val_loader = DataLoaderLite(B=B, T=T, process_rank=ddp_rank, num_processes=ddp_world_size, split="val", data_root=cfg.data_root, verbose=master_process)
+
+    torch.set_float32_matmul_precision('high') #set fp32 precision.Set hifh so everything will be in tensor float 32(tf32)
+    autocast_dtype = torch.bfloat16 if cfg.autocast else torch.float32
+    if cfg.hella_every > 0:
+        from hellaswag import evaluate_batched #lives next to the package, imported here so importing gpt2.train stays cheap
+
+    #Create Model
+    model = GPT(GPTConfig(block_size=cfg.block_size, vocab_size=cfg.vocab_size, n_layer=cfg.n_layer, n_head=cfg.n_head, n_embd=cfg.n_embd,
+                          checkpoint_activations=cfg.checkpoint_activations, checkpoint_every=cfg.checkpoint_every))
+    model.to(device)
+    if cfg.use_compile:
+        model = torch.compile(model)
+    if ddp:
+        model = DDP(model, device_ids=[ddp_local_rank] if device_type == 'cuda' else None)
+    raw_model = model.module if ddp else model
+
+    max_lr = cfg.max_lr
+    min_lr = max_lr * cfg.min_lr_ratio
+    warmup_steps = cfg.warmup_steps
+    max_steps = cfg.max_steps
+    def get_lr(it):
+        # 1) linear warmup for warmup_iters steps
+        if it < warmup_steps:
+            return max_lr * (it+1) / warmup_steps
+        # 2) if it > lr_decay_iters, return min learning rate
+        if it > max_steps:
+            return min_lr
+        # 3) in between, use cosine decay down to min learning rate
+        decay_ratio = (it - warmup_steps) / (max_steps - warmup_steps)
+        assert 0 <= decay_ratio <= 1
+        coeff = 0.5 * (1.0 + math.cos(math.pi * decay_ratio)) # coeff starts at 1 and goes to 0
+        return min_lr + coeff * (max_lr - min_lr)
+
+    #optimzer
+    optimizer = raw_model.configure_optimizers(weight_decay=cfg.weight_decay, learning_rate=max_lr, device_type=device_type,
+                                               verbose=master_process, zero=cfg.zero and ddp)
+
+
+    #creating the log directory.Will write checkpoints to and log to
+    log_dir = cfg.log_dir
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"log.txt")
+    checkpoint_writer = CheckpointWriter(log_dir, keep_last=cfg.keep_last)
+
+    start_step = 0
+    checkpoints = list_checkpoints(log_dir) if cfg.resume else []
+    if checkpoints:
+        checkpoint = torch.load(checkpoints[-1], map_location='cpu', weights_only=False)
+        raw_model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer']) #under ZeRO every rank picks its own shard out of the full state
+        train_loader.load_state_dict(checkpoint['train_loader'])
+        torch.set_rng_state(checkpoint['torch_rng_state'])
+        if torch.cuda.is_available() and checkpoint['cuda_rng_state'] is not None:
+            torch.cuda.set_rng_state_all(checkpoint['cuda_rng_state'])
+        np.random.set_state(checkpoint['numpy_rng_state'])
+        start_step = checkpoint['step'] #checkpoints are taken before the training step, so redo that step
+        if master_process:
+            print(f"resuming from {checkpoints[-1]} at step {start_step}")
+        del checkpoint
+    elif master_process:
+        with open(log_file, "w") as f: # open for writing to clear the file
+            pass
+
+    #step time, tok/sec, MFU and peak memory as JSONL in log_dir/metrics.jsonl
+    trace_steps = tuple(int(s) for s in cfg.trace_steps.split(",")) if cfg.trace_steps else None
+    profiler = StepProfiler(log_path=os.path.join(log_dir, "metrics.jsonl") if master_process else None,
+                            enabled=cfg.profile, device_type=device_type, flops_per_token=raw_model.flops_per_token(T),
+                            peak_flops=cfg.peak_flops, trace_steps=trace_steps, trace_dir=log_dir, rank=ddp_rank,
+                            world_size=ddp_world_size)
+
+
+    for step in range(start_step, max_steps):
+        t0 = time.time()
+        last_step = (step == max_steps - 1)
+
+        #once in a while evaluate validation loss
+        if cfg.val_every > 0 and (step % cfg.val_every == 0 or last_step):
+            model.eval()
+            val_loader.reset()
+            with torch.no_grad():
+                val_loss_accum = 0.0
+                val_loss_steps = cfg.val_loss_steps
+                for _ in range(val_loss_steps):
+                    x, y = val_loader.next_batch()
+                    x, y = x.to(device), y.to(device)
+                    with torch.autocast(device_type=device_type, dtype=autocast_dtype, enabled=cfg.autocast):
+                        logits, loss = model(x, y)
+                    loss = loss / val_loss_steps
+                    val_loss_accum += loss.detach()
+            if ddp:
+                dist.all_reduce(val_loss_accum, op=dist.ReduceOp.SUM) #SUM and divide, gloo has no ReduceOp.AVG
+                val_loss_accum /= ddp_world_size
+            save_checkpoint = step > start_step or last_step #save checkpoint in a every validation
+            if save_checkpoint and cfg.zero and ddp:
+                optimizer.consolidate_state_dict(to=0) #collective, gathers the sharded AdamW state on the master
+            if master_process:
+                print(f"validation loss: {val_loss_accum.item():.4f}")
+                with open(log_file, "a") as f:
+                    f.write(f"{step} val {val_loss_accum.item():.4f}\n")
+                if save_checkpoint:
+                    # snapshot to cpu and write in the background, the other ranks don't wait on the disk
+                    checkpoint = {
+                        'model': raw_model.state_dict(),
+                        'optimizer': optimizer.state_dict(),
+                        'step': step,
+                        'val_loss': val_loss_accum.item(),
+                        'config': raw_model.config,
+                        'train_loader': train_loader.state_dict(),
+                        'torch_rng_state': torch.get_rng_state(),
+                        'cuda_rng_state': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                        'numpy_rng_state': np.random.get_state()
+                    }
+                    checkpoint_writer.save(step, checkpoint)
+
+
+        #Evaluating Hellaswag once in a while
+        if cfg.hella_every > 0 and (step % cfg.hella_every == 0 or last_step):
+            model.eval()
+            #pre-tokenized examples in fixed-size, length-bucketed batches so this also works with torch.compile
+            #batches are split round-robin over the ddp processes
+            num_correct_norm, num_total = evaluate_batched(model, device, device_type, split="val", batch_size=cfg.hella_batch_size,
+                                                           process_rank=ddp_rank, num_processes=ddp_world_size, autocast=cfg.autocast)
+            #reduce the stats accross all process
+            if ddp:
+                num_total = torch.tensor(num_total, dtype=torch.long, device=device)
+                num_correct_norm = torch.tensor(num_correct_norm, dtype=torch.long, device=device)
+                dist.all_reduce(num_total, op=dist.ReduceOp.SUM)
+                dist.all_reduce(num_correct_norm, op=dist.ReduceOp.SUM)
+                num_total = num_total.item()
+                num_correct_norm = num_correct_norm.item()
+            acc_norm = num_correct_norm / num_total #accuracy of hellaswag
+            if master_process:
+                print(f"HellaSwag accuracy: {num_correct_norm}/{num_total}={acc_norm:.4f}")
+                with open(log_file, "a") as f:
+                    f.write(f"{step} hella {acc_norm:.4f}\n")
+
+
+        # #Generate once in a while
+        # if ((step > 0 and step % 250 == 0) or last_step) and (not use_compile) :
+        #     model.eval()
+        #     num_return_sequences = 4
+        #     max_length = 32
+        #     enc = tiktoken.get_encoding('gpt2')
+        #     tokens = enc.encode("Hello, I'm a language model,")
+        #     tokens = torch.tensor(tokens, dtype=torch.long)
+        #     tokens = tokens.unsqueeze(0).repeat(num_return_sequences, 1)
+        #     xgen = tokens.to(device)
+        #     sample_rng = torch.Generator(device=device)
+        #     sample_rng.manual_seed(42 + ddp_rank)
+        #     while xgen.size(1) < max_length:
+        #         with torch.no_grad():
+        #             logits, loss = model(xgen) #(B, T, vocab_size)
+        #             logits = logits[:, -1, :] #(B, vocab_size)
+        #             probs = F.softmax(logits, dim=-1) #get probabilities
+        #             topk_probs, topk_indices = torch.topk(probs, 50, dim=-1) #topk sampling for top 50 probabilities
+        #             ix = torch.multinomial(topk_probs, 1, generator=sample_rng)#(B,1),selecting a token from topk
+        #             xcol = torch.gather(topk_indices, -1, ix)#gathering corresponding indices
+        #             xgen = torch.cat((xgen,xcol), dim = 1)#append to sequence
+        #     #print generated sequence
+        #     for i in range(num_return_sequences):
+        #         tokens = xgen[i, :max_length].tolist()
+        #         decoded = enc.decode(tokens)
+        #         print(f"rank {ddp_rank} sample {i}: {decoded}")
+
+
+        #training loop
+        model.train()
+        profiler.start_step(step)
+        optimizer.zero_grad()
+        loss_accum = 0.0
+        data_wait = 0.0 #time the training loop spends blocked on the data loader
+        for micro_step in range(grad_accum_steps):
+            t_data = time.time()
+            with profiler.phase("data"):
+                x, y = train_loader.next_batch()
+            data_wait += time.time() - t_data
+            with profiler.phase("h2d"): #a no-op when the PrefetchLoader already returned device tensors, their copy is timed under "data"
+                x, y = x.to(device), y.to(device)
+            last_micro_step = (micro_step == grad_accum_steps - 1)
+            if ddp:
+                model.require_backward_grad_sync = last_micro_step #this line will mkae ddp to synchronize gpus only for last loop microstep and sync off in all other steps
+            with profiler.phase("forward"):
+                with torch.autocast(device_type=device_type, dtype=autocast_dtype, enabled=cfg.autocast): #using mixed precision
+                    logits, loss = model(x, y)
+            #Watch video for understand need of scalling in loss calculated below
+            loss = loss / grad_accum_steps #loss scaling.otherwise weight gradient wont we same as normal loss without microstep.reason explained in video
+            loss_accum += loss.detach() #used detach for not include this in computational graph
+                                        #since loss is scaled loss which is divided by grad_accum_step it will be a small value so the cummulated loss will be real loss to print.
+            #under ddp the gradient all-reduce runs overlapped with the last backward, so it is part of the backward_sync phase
+            with profiler.phase("backward_sync" if ddp and last_micro_step else "backward"):
+                loss.backward()
+
+        if ddp:
+            with profiler.phase("loss_allreduce"): #only the scalar loss for logging, the gradients were synced in backward_sync
+                dist.all_reduce(loss_accum, op=dist.ReduceOp.SUM) #SUM and divide, gloo has no ReduceOp.AVG
+                loss_accum /= ddp_world_size #loss accum will be the average of loss accum in all gpus
+
+        with profiler.phase("clip"):
+            norm = torch.nn.utils.clip_grad_norm_(model.parameters(), 1.0) #gradient clipping
+        #determine and set learning rate for this iteration
+        lr = get_lr(step)
+        for param_group in optimizer.param_groups:
+            param_group['lr'] = lr
+        with profiler.phase("optimizer"):
+            optimizer.step() #under ZeRO each rank updates its shard and broadcasts the new parameters
+        if device_type == 'cuda':
+            torch.cuda.synchronize() #it will make a que for next process till completing current process in gpu
+        t1 = time.time()
+        dt = (t1-t0)*1000 #time difference in milliseconds
+        tokens_processed = train_loader.B * train_loader.T * grad_accum_steps  * ddp_world_size
+        tokens_per_sec = tokens_processed / (t1-t0)
+        if master_process:
+            print(f"step:{step:5d} | loss: {loss_accum.item():.6f} | lr: {lr:.4e} |  norm:{norm:.4f} | dt: {dt:.2f}ms | tok/sec: {tokens_per_sec:.2f} | data wait: {data_wait*1000:.2f}ms" )
+            if step == start_step:
+                print(f"optimizer state on rank 0: {optimizer_state_bytes(optimizer) / 2**20:.2f}MB")
+        #every rank runs the step bookkeeping (trace window), only the master writes metrics.jsonl
+        profiler.end_step(step, t1-t0, tokens_processed, loss=loss_accum.item(), lr=lr, norm=norm.item(), data_wait_ms=data_wait*1000)
+        if master_process:
+            with open(log_file, 'a') as f:
+                f.write(f"{step} train {loss_accum.item():.6f}\n")
+    if master_process:
+        checkpoint_writer.wait() #make sure the last checkpoint is on disk
+    if ddp:
+        destroy_process_group()
+
+
+if __name__ == "__main__":
+    main(parse_args())
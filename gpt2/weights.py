@@ -0,0 +1,100 @@
+"""
+Inference-only weight files: just the model weights (optionally bf16/fp16) and the config,
+without optimizer state or the `_orig_mod.`/`module.` prefixes from torch.compile and DDP.
+They are loaded with mmap into a model built on the meta device, so tensors are backed by
+the page cache and nothing is initialized or copied up front.
+Converted HF weights are cached in the same format.
+
+python -m gpt2.weights export log/model_19072.pt gpt2_124M.pt --dtype bf16
+python -m gpt2.weights pretrained gpt2
+"""
+import os
+from dataclasses import asdict
+import torch
+from gpt2.model import GPT, GPTConfig
+#_______________________________________________________________________________
+
+PRETRAINED_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pretrained")
+DTYPES = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+TIED_KEY = 'transformer.wte.weight' #same tensor as lm_head.weight, stored once and re-tied on load
+
+def clean_state_dict(state_dict):
+    # strip the wrapper prefixes torch.compile (_orig_mod.) and DDP (module.) add to the keys
+    cleaned = {}
+    for k, v in state_dict.items():
+        for prefix in ('module.', '_orig_mod.'):
+            if k.startswith(prefix):
+                k = k[len(prefix):]
+        cleaned[k] = v
+    return cleaned
+
+def save_inference(model, path, dtype=None):
+    model = getattr(model, 'module', model) #DDP
+    model = getattr(model, '_orig_mod', model) #torch.compile
+    save_state_dict(model.state_dict(), model.config, path, dtype)
+
+def save_state_dict(state_dict, config, path, dtype=None):
+    state_dict = clean_state_dict(state_dict)
+    state_dict.pop(TIED_KEY, None)
+    state_dict = {k: (v.to(dtype) if dtype is not None else v).detach().contiguous() for k, v in state_dict.items()}
+    config = config if isinstance(config, dict) else asdict(config)
+    tmp_path = path + ".tmp"
+    torch.save({'config': config, 'model': state_dict}, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_inference(path, device='cpu', quant_mode=None):
+    """
+    Loads a file written by save_inference (or gpt2.quantize.save_quantized). On cpu the parameters
+    stay memory-mapped views of the file (pages are read on first use), on other devices they are
+    copied over once. quant_mode picks the int8 matmul of quantized files (gpt2.quantize.MODES),
+    weight-only int8pack by default.
+    """
+    checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    if checkpoint.get('quantization') is not None:
+        from gpt2.quantize import load_quantized, DEFAULT_MODE
+        return load_quantized(path, device, mode=quant_mode or DEFAULT_MODE, checkpoint=checkpoint)
+    config = GPTConfig(**checkpoint['config'])
+    with torch.device('meta'):
+        model = GPT(config) #no memory allocated and no init, the weights are assigned below
+    state_dict = checkpoint['model']
+    state_dict[TIED_KEY] = state_dict['lm_head.weight']
+    model.load_state_dict(state_dict, assign=True)
+    model.transformer.wte.weight = model.lm_head.weight #assign=True replaced the tied parameter
+    model.to(device)
+    model.eval()
+    return model
+
+def export_checkpoint(checkpoint_path, out_path, dtype=None):
+    # training checkpoint (model + optimizer + loader/rng state) -> inference-only file
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', mmap=True, weights_only=False)
+    save_state_dict(checkpoint['model'], checkpoint['config'], out_path, dtype)
+
+def load_pretrained(model_type, device='cpu', cache_dir=PRETRAINED_CACHE_DIR):
+    """
+    Same as GPT.from_pretrained, but the converted weights are cached in cache_dir so
+    transformers is only needed (and the HF weights only downloaded and transposed) once.
+    """
+    path = os.path.join(cache_dir, f"{model_type}.pt")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        save_inference(GPT.from_pretrained(model_type), path)
+    return load_inference(path, device)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="convert a training checkpoint to an inference file")
+    export_parser.add_argument("checkpoint", type=str)
+    export_parser.add_argument("out", type=str)
+    export_parser.add_argument("--dtype", type=str, default=None, choices=list(DTYPES))
+    pretrained_parser = subparsers.add_parser("pretrained", help="convert and cache HF GPT-2 weights")
+    pretrained_parser.add_argument("model_type", type=str, default="gpt2")
+    args = parser.parse_args()
+    if args.command == "export":
+        export_checkpoint(args.checkpoint, args.out, DTYPES[args.dtype] if args.dtype else None)
+        print(f"wrote {args.out}")
+    else:
+        load_pretrained(args.model_type)
+        print(f"cached {args.model_type} in {PRETRAINED_CACHE_DIR}")
@@ -8,10 +8,10 @@ import json
 import requests
 import tiktoken
 from tqdm import tqdm
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
-from transformers import GPT2LMHeadModel
 
 DATA_CACHE_DIR = os.path.join(os.path.dirname(__file__), "hellaswag")
 
@@ -35,7 +35,14 @@ hellaswags = {
     "test": "https://raw.githubusercontent.com/rowanz/hellaswag/master/data/hellaswag_test.jsonl",
 }
 
-enc = tiktoken.get_encoding("gpt2")
+_enc = None
+
+def get_encoding():
+    # loading the BPE ranks is slow, so only do it once an example actually gets tokenized
+    global _enc
+    if _enc is None:
+        _enc = tiktoken.get_encoding("gpt2")
+    return _enc
 
 def download(split):
     """Downloads HellaSwag DATA_CACHE_DIR"""
@@ -65,6 +72,7 @@ def render_example(example):
     }
 
     # gather up all the tokens
+    enc = get_encoding()
     ctx_tokens = enc.encode(ctx)
     data["ctx_tokens"] = ctx_tokens
     tok_rows = []
@@ -96,6 +104,7 @@ def iterate_examples(split):
 @torch.no_grad()
 def evaluate(model_type, device):
 
+    from transformers import GPT2LMHeadModel #heavy import, only needed for this standalone eval
     torch.set_float32_matmul_precision('high') # use tf32
     model = GPT2LMHeadModel.from_pretrained(model_type)
     model.to(device)
@@ -145,7 +154,7 @@ def evaluate(model_type, device):
             print(f"predicted: {pred_norm}, actual: {label}")
 
 
-def get_most_likely_row(tokens, mask, logits):
+def get_row_losses(tokens, mask, logits):
         shift_logits = (logits[..., :-1, :]).contiguous() #this will be x for loss calculation
         shift_tokens = (tokens[..., 1:]).contiguous() #this will be y for loss calculation
         shift_mask = (mask[..., 1:]).contiguous() #shifting same as tokens shifted
@@ -155,9 +164,93 @@ def get_most_likely_row(tokens, mask, logits):
         shift_losses = shift_losses.view(tokens.size(0), -1)
         masked_shift_losses = shift_losses * shift_mask
         sum_loss = masked_shift_losses.sum(dim=1)
-        avg_loss = sum_loss / shift_mask.sum(dim=1)
+        avg_loss = sum_loss / shift_mask.sum(dim=1).clamp(min=1) #padding rows have an empty mask
+        return avg_loss
+
+def get_most_likely_row(tokens, mask, logits):
+        avg_loss = get_row_losses(tokens, mask, logits)
         pred_norm = avg_loss.argmin().item() #taking the index of minimum loss
-        return pred_norm   
+        return pred_norm
+
+def get_most_likely_rows(tokens, mask, logits):
+        # same as get_most_likely_row, for a (4*N, L) batch of N examples at once
+        avg_loss = get_row_losses(tokens, mask, logits)
+        pred_norm = avg_loss.view(-1, 4).argmin(dim=1) #(N,)
+        return pred_norm
+
+#_______________________________________________________________________________
+# batched evaluation on a pre-tokenized split
+
+def tokenize_split(split):
+    """
+    Tokenizes a split once and caches it next to the jsonl as hellaswag_{split}.npz:
+    all 4 context+ending rows of every example back to back in one uint16 array,
+    plus the row offsets, context lengths and labels.
+    """
+    cache_filename = os.path.join(DATA_CACHE_DIR, f"hellaswag_{split}.npz")
+    if not os.path.exists(cache_filename):
+        rows, ctx_lens, labels = [], [], []
+        for example in iterate_examples(split):
+            data, _, _, label = render_example(example)
+            for end_tokens in data["ending_tokens"]:
+                rows.append(data["ctx_tokens"] + end_tokens)
+            ctx_lens.append(len(data["ctx_tokens"]))
+            labels.append(label)
+        row_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        row_offsets[1:] = np.cumsum([len(row) for row in rows])
+        tokens = np.fromiter((t for row in rows for t in row), dtype=np.uint16, count=row_offsets[-1])
+        tmp_filename = f"{cache_filename}.{os.getpid()}.tmp.npz" #ranks may tokenize concurrently
+        np.savez(tmp_filename, tokens=tokens, row_offsets=row_offsets,
+                 ctx_lens=np.array(ctx_lens, dtype=np.int32), labels=np.array(labels, dtype=np.int64))
+        os.replace(tmp_filename, cache_filename)
+    cache = np.load(cache_filename)
+    return cache["tokens"], cache["row_offsets"], cache["ctx_lens"], cache["labels"]
+
+def iterate_batches(split, batch_size=8, pad_multiple=32, process_rank=0, num_processes=1):
+    """
+    Yields (tokens, mask, labels, num_valid) batches of `batch_size` examples (4*batch_size rows).
+    Examples are sorted by length so each batch needs little padding, and the padded length is
+    rounded up to a multiple of `pad_multiple` so a compiled model only sees a handful of shapes.
+    The last batch is filled up with empty examples, only the first num_valid are real.
+    Batches are split round-robin across processes.
+    """
+    tokens, row_offsets, ctx_lens, labels = tokenize_split(split)
+    row_lens = np.diff(row_offsets).reshape(-1, 4)
+    order = np.argsort(row_lens.max(axis=1), kind="stable") #length bucketing
+    num_batches = (len(order) + batch_size - 1) // batch_size
+    for b in range(process_rank, num_batches, num_processes):
+        idx = order[b * batch_size:(b + 1) * batch_size]
+        max_len = int(row_lens[idx].max())
+        L = ((max_len + pad_multiple - 1) // pad_multiple) * pad_multiple
+        batch_tokens = np.zeros((batch_size * 4, L), dtype=np.int64)
+        batch_mask = np.zeros((batch_size * 4, L), dtype=np.int64)
+        batch_labels = np.zeros((batch_size,), dtype=np.int64)
+        for j, i in enumerate(idx):
+            for r in range(4):
+                start, end = row_offsets[4 * i + r], row_offsets[4 * i + r + 1]
+                batch_tokens[4 * j + r, :end - start] = tokens[start:end]
+                batch_mask[4 * j + r, ctx_lens[i]:end - start] = 1
+            batch_labels[j] = labels[i]
+        yield torch.from_numpy(batch_tokens), torch.from_numpy(batch_mask), torch.from_numpy(batch_labels), len(idx)
+
+@torch.no_grad()
+def evaluate_batched(model, device, device_type, split="val", batch_size=8, process_rank=0, num_processes=1, autocast=True):
+    """
+    Scores this process's share of the split with a GPT-style model (model(tokens) -> logits, loss).
+    Returns (num_correct_norm, num_total), to be summed across processes.
+    """
+    num_correct_norm = 0
+    num_total = 0
+    for tokens, mask, labels, num_valid in iterate_batches(split, batch_size, process_rank=process_rank, num_processes=num_processes):
+        tokens = tokens.to(device)
+        mask = mask.to(device)
+        labels = labels.to(device)
+        with torch.autocast(device_type=device_type, dtype=torch.bfloat16, enabled=autocast):
+            logits, loss = model(tokens)
+        pred_norm = get_most_likely_rows(tokens, mask, logits)
+        num_correct_norm += (pred_norm[:num_valid] == labels[:num_valid]).sum().item()
+        num_total += num_valid
+    return num_correct_norm, num_total
 
 if __name__ == "__main__":
     import argparse
@@ -0,0 +1,367 @@
+"""
+Streaming, parallel and resumable Google Drive transfers (checkpoints, data shards).
+Downloads are written chunk by chunk into <name>.part with ranged requests and renamed once the
+md5 matches the one Drive reports, so memory stays at one chunk whatever the file size. Uploads
+go through Drive resumable upload sessions and are checked against the md5 Drive computes.
+Both continue where an interrupted run stopped (the size of the .part file / the session kept in
+.transfer_state.json), move several files at once and grow or shrink the chunk size to keep
+every request near target_seconds.
+The Drive calls sit behind a small backend interface: DriveBackend wraps a service from
+Google.Create_Service, LocalBackend implements the same calls on a local folder for testing.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_ALIGN = 256 * 1024 #Drive wants every upload chunk but the last in multiples of 256KB
+MB = 2**20
+RETRY_BACKOFF = 0.5 #seconds before the first retry, doubled every time
+
+class TransientError(Exception):
+    """A failed request that can be retried (connection error, 429, 5xx)."""
+
+class SessionExpired(Exception):
+    """The resumable upload session is gone, the upload has to start over."""
+
+class ChecksumError(Exception):
+    pass
+
+
+class AdaptiveChunker:
+    # doubles the chunk size while requests finish well under target_seconds, halves it when they take too long
+
+    def __init__(self, chunk_size=8 * MB, min_size=CHUNK_ALIGN, max_size=64 * MB, target_seconds=1.0, adaptive=True):
+        self.size = chunk_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.adaptive = adaptive
+
+    def update(self, seconds):
+        if not self.adaptive:
+            return
+        if seconds < self.target_seconds / 2:
+            self.size = min(self.size * 2, self.max_size)
+        elif seconds > self.target_seconds * 2:
+            self.size = max(self.size // 2, self.min_size)
+
+
+def with_retries(fn, retries=5):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except TransientError:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_BACKOFF * 2**attempt)
+
+def file_md5(path, end=None, block_size=8 * MB):
+    # md5 of the first `end` bytes of the file (all of it by default), read a block at a time
+    md5 = hashlib.md5()
+    remaining = os.path.getsize(path) if end is None else end
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            md5.update(block)
+            remaining -= len(block)
+    return md5
+
+
+class TransferState:
+    """Upload sessions of unfinished uploads, in a json file next to the uploaded files."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            if value is None:
+                self.entries.pop(key, None)
+            else:
+                self.entries[key] = value
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+
+#_______________________________________________________________________________
+
+def download_file(backend, file_id, path, chunker=None, retries=5, progress=None):
+    """Downloads file_id to path, resuming from path.part if an earlier run was interrupted."""
+    chunker = chunker or AdaptiveChunker()
+    info = with_retries(lambda: backend.info(file_id), retries)
+    size = info['size']
+    part_path = path + ".part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset > size: #not this file, start over
+        offset = 0
+        os.remove(part_path)
+    md5 = file_md5(part_path) if offset > 0 else hashlib.md5() #bytes from the earlier run
+    with open(part_path, 'ab') as f:
+        while offset < size:
+            end = min(offset + chunker.size, size)
+            t0 = time.time()
+            data = with_retries(lambda: backend.read(file_id, offset, end), retries)
+            chunker.update(time.time() - t0)
+            f.write(data)
+            md5.update(data)
+            offset += len(data)
+            if progress is not None:
+                progress(os.path.basename(path), offset, size)
+    if md5.hexdigest() != info['md5']:
+        os.remove(part_path) #corrupt, the next run downloads it again from scratch
+        raise ChecksumError(f"{path}: md5 {md5.hexdigest()} does not match {info['md5']}")
+    os.replace(part_path, path)
+    return path
+
+def upload_file(backend, path, folder_id=None, mime_type=None, state=None, chunker=None, retries=5, progress=None):
+    """Uploads path into folder_id and returns the new file id, continuing an upload session from `state`."""
+    chunker = chunker or AdaptiveChunker()
+    chunker.min_size = max(chunker.min_size, CHUNK_ALIGN)
+    state = state or TransferState(os.path.join(os.path.dirname(os.path.abspath(path)), ".transfer_state.json"))
+    size = os.path.getsize(path)
+    key = os.path.abspath(path)
+    entry = state.get(key)
+    offset, result = 0, None
+    if entry is not None and entry['size'] == size and entry['mtime'] == os.path.getmtime(path) and entry['folder_id'] == folder_id:
+        try:
+            offset, result = with_retries(lambda: backend.upload_status(entry['session'], size), retries)
+        except SessionExpired:
+            entry = None
+    else:
+        entry = None
+    if entry is None:
+        session = with_retries(lambda: backend.create_upload(os.path.basename(path), folder_id, size, mime_type), retries)
+        entry = {'session': session, 'size': size, 'mtime': os.path.getmtime(path), 'folder_id': folder_id}
+        state.set(key, entry)
+
+    attempt = 0
+    with open(path, 'rb') as f:
+        while result is None:
+            f.seek(offset)
+            n = chunker.size - chunker.size % CHUNK_ALIGN
+            data = f.read(n)
+            t0 = time.time()
+            try:
+                offset, result = backend.upload_chunk(entry['session'], offset, data, size)
+            except TransientError:
+                if attempt == retries:
+                    raise
+                time.sleep(RETRY_BACKOFF * 2**attempt)
+                attempt += 1
+                offset, result = with_retries(lambda: backend.upload_status(entry['session'], size), retries) #what the server kept
+                continue
+            attempt = 0
+            chunker.update(time.time() - t0)
+            if progress is not None:
+                progress(os.path.basename(path), offset, size)
+    state.set(key, None)
+    local_md5 = file_md5(path).hexdigest()
+    if result['md5'] != local_md5:
+        raise ChecksumError(f"{path}: uploaded md5 {result['md5']} does not match {local_md5}")
+    return result['id']
+
+def download_files(backend, file_ids, paths, max_workers=4, chunk_size=8 * MB, adaptive=True, retries=5, progress=None):
+    """Downloads several files at once, returns their paths in order."""
+    def job(file_id, path):
+        return download_file(backend, file_id, path, AdaptiveChunker(chunk_size, adaptive=adaptive), retries, progress)
+    with ThreadPoolExecutor(max_workers) as pool:
+        return list(pool.map(job, file_ids, paths))
+
+def upload_files(backend, paths, folder_id=None, mime_types=None, max_workers=4, chunk_size=8 * MB, adaptive=True,
+                 retries=5, state_path=None, progress=None):
+    """Uploads several files at once, returns their Drive ids in order."""
+    mime_types = mime_types or [None] * len(paths)
+    state = TransferState(state_path or os.path.join(os.path.dirname(os.path.abspath(paths[0])), ".transfer_state.json"))
+    def job(path, mime_type):
+        return upload_file(backend, path, folder_id, mime_type, state, AdaptiveChunker(chunk_size, adaptive=adaptive), retries, progress)
+    with ThreadPoolExecutor(max_workers) as pool:
+        return list(pool.map(job, paths, mime_types))
+
+def print_progress(name, done, total):
+    print(f"{name}: {done / MB:.1f}/{total / MB:.1f}MB ({100 * done / max(total, 1):.0f}%)")
+
+#_______________________________________________________________________________
+
+class DriveBackend:
+    """Drive v3 over the authorized http client of a service built by Google.Create_Service."""
+
+    FILES = "https://www.googleapis.com/drive/v3/files"
+    UPLOAD = "https://www.googleapis.com/upload/drive/v3/files"
+
+    def __init__(self, service):
+        self.credentials = service._http.credentials
+        self.local = threading.local()
+
+    def _http(self):
+        # httplib2 connections aren't thread safe, every transfer thread gets its own
+        if not hasattr(self.local, 'http'):
+            import httplib2
+            import google_auth_httplib2
+            self.local.http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return self.local.http
+
+    def _request(self, uri, method="GET", body=None, headers=None):
+        try:
+            resp, content = self._http().request(uri, method=method, body=body, headers=headers or {})
+        except OSError as e: #connection reset, timeout, ...
+            raise TransientError(str(e)) from e
+        if resp.status == 429 or resp.status >= 500:
+            raise TransientError(f"{resp.status} from {uri}")
+        return resp, content
+
+    def info(self, file_id):
+        resp, content = self._request(f"{self.FILES}/{file_id}?fields=name,size,md5Checksum&supportsAllDrives=true")
+        if resp.status != 200:
+            raise RuntimeError(f"can't get {file_id}: {resp.status} {content[:200]}")
+        meta = json.loads(content)
+        return {'name': meta['name'], 'size': int(meta['size']), 'md5': meta['md5Checksum']}
+
+    def read(self, file_id, start, end):
+        resp, content = self._request(f"{self.FILES}/{file_id}?alt=media&supportsAllDrives=true",
+                                      headers={'Range': f"bytes={start}-{end - 1}"})
+        if resp.status not in (200, 206):
+            raise RuntimeError(f"can't download {file_id}: {resp.status} {content[:200]}")
+        return content
+
+    def create_upload(self, name, folder_id, size, mime_type):
+        metadata = {'name': name}
+        if folder_id:
+            metadata['parents'] = [folder_id]
+        resp, content = self._request(f"{self.UPLOAD}?uploadType=resumable&fields=id,md5Checksum&supportsAllDrives=true", "POST",
+                                      json.dumps(metadata), {'Content-Type': 'application/json; charset=UTF-8',
+                                                             'X-Upload-Content-Type': mime_type or 'application/octet-stream',
+                                                             'X-Upload-Content-Length': str(size)})
+        if resp.status != 200:
+            raise RuntimeError(f"can't start the upload of {name}: {resp.status} {content[:200]}")
+        return resp['location']
+
+    @staticmethod
+    def _committed(resp):
+        # 308 responses say how much the server has as "Range: bytes=0-<last byte>"
+        return int(resp['range'].split('-')[1]) + 1 if 'range' in resp else 0
+
+    def _upload_response(self, session, resp, content, size):
+        # (bytes the server has, None) while the upload goes on, (size, {'id', 'md5'}) once the file is complete
+        if resp.status in (200, 201):
+            meta = json.loads(content)
+            return size, {'id': meta['id'], 'md5': meta['md5Checksum']}
+        if resp.status == 308:
+            return self._committed(resp), None
+        if resp.status in (404, 410):
+            raise SessionExpired(session)
+        raise RuntimeError(f"upload failed: {resp.status} {content[:200]}")
+
+    def upload_status(self, session, size):
+        resp, content = self._request(session, "PUT", b"", {'Content-Range': f"bytes */{size}", 'Content-Length': '0'})
+        return self._upload_response(session, resp, content, size)
+
+    def upload_chunk(self, session, offset, data, size):
+        content_range = f"bytes {offset}-{offset + len(data) - 1}/{size}" if data else f"bytes */{size}" #empty file
+        resp, content = self._request(session, "PUT", data, {'Content-Range': content_range, 'Content-Length': str(len(data))})
+        return self._upload_response(session, resp, content, size)
+
+
+class LocalBackend:
+    """
+    A fake Drive in a local folder with the same calls as DriveBackend, for tests and benchmarks.
+    latency (seconds per request), bandwidth (bytes/sec per request) and fail_rate (probability
+    that a request raises TransientError) simulate the network.
+    """
+
+    def __init__(self, root, latency=0.0, bandwidth=None, fail_rate=0.0, seed=0):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        os.makedirs(os.path.join(root, "files"), exist_ok=True)
+        os.makedirs(os.path.join(root, "uploads"), exist_ok=True)
+
+    def _network(self, num_bytes=0):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += num_bytes
+            fail = self.rng.random() < self.fail_rate
+        time.sleep(self.latency + (num_bytes / self.bandwidth if self.bandwidth else 0.0))
+        if fail:
+            raise TransientError("simulated network error")
+
+    def _meta_path(self, file_id):
+        return os.path.join(self.root, "files", file_id + ".json")
+
+    def add_file(self, path):
+        # puts a local file on the fake Drive and returns its id
+        with open(path, 'rb') as f:
+            data = f.read()
+        file_id = uuid.uuid4().hex
+        with open(os.path.join(self.root, "files", file_id), 'wb') as f:
+            f.write(data)
+        with open(self._meta_path(file_id), "w") as f:
+            json.dump({'name': os.path.basename(path), 'parents': [], 'size': len(data), 'md5': hashlib.md5(data).hexdigest()}, f)
+        return file_id
+
+    def info(self, file_id):
+        self._network()
+        with open(self._meta_path(file_id)) as f:
+            return json.load(f)
+
+    def read(self, file_id, start, end):
+        self._network(end - start)
+        with open(os.path.join(self.root, "files", file_id), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def create_upload(self, name, folder_id, size, mime_type):
+        self._network()
+        session = uuid.uuid4().hex
+        with open(os.path.join(self.root, "uploads", session + ".json"), "w") as f:
+            json.dump({'name': name, 'parents': [folder_id] if folder_id else [], 'size': size}, f)
+        open(os.path.join(self.root, "uploads", session), 'wb').close()
+        return session
+
+    def upload_status(self, session, size):
+        self._network()
+        path = os.path.join(self.root, "uploads", session)
+        if not os.path.exists(path):
+            raise SessionExpired(session)
+        return os.path.getsize(path), None
+
+    def upload_chunk(self, session, offset, data, size):
+        path = os.path.join(self.root, "uploads", session)
+        if not os.path.exists(path):
+            raise SessionExpired(session)
+        self._network(len(data))
+        received = os.path.getsize(path)
+        if offset != received: #like Drive, only accept the next bytes and report what it has
+            return received, None
+        assert offset + len(data) == size or len(data) % CHUNK_ALIGN == 0, "chunks must be multiples of 256KB"
+        with open(path, 'ab') as f:
+            f.write(data)
+        if offset + len(data) < size:
+            return offset + len(data), None
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        file_id = uuid.uuid4().hex
+        os.replace(path, os.path.join(self.root, "files", file_id))
+        os.remove(path + ".json")
+        meta['md5'] = file_md5(os.path.join(self.root, "files", file_id)).hexdigest()
+        with open(self._meta_path(file_id), "w") as f:
+            json.dump(meta, f)
+        return size, {'id': file_id, 'md5': meta['md5']}
@@ -1,6 +1,6 @@
-###############chunked ulpoad wit ptogress bar############################
-from googleapiclient.http import MediaFileUpload
+###############parallel resumable upload with progress and md5 check############################
 from Google import Create_Service
+from transfer import DriveBackend, upload_files, print_progress
 import os
 
 CLIENT_SECRET_FILE = 'client_secret_827351215080-ghfiqr1eknimkcce7nd30gljbb5279oj.apps.googleusercontent.com.json' #google secret key .json folder path
@@ -14,39 +14,13 @@ folder_id = ''    #folder id of google drive folder you need to upload
 file_names = [''] #your fioe name here
 mime_types = [''] #mime type of the file format here
 
-for file_name, mime_type in zip(file_names, mime_types):
-    file_metadata = {
-        'name': file_name,
-        'parents': [folder_id]
-    }
-
-    media = MediaFileUpload(
-        os.path.join('upld_folder', file_name), 
-        mimetype=mime_type,
-        resumable=True,
-        chunksize=256 * 1024 #256kb chunks
-    )
-
-    request = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields='id'
-    )
-    
-    response = None
-    last_progress = -1  # Initialize with a value that will trigger first progress update
-    
-    while response is None:
-        status, response = request.next_chunk()
-        if status:
-            current_progress = int(status.progress() * 100)
-            # Only print if progress increases by at least 1%
-            if current_progress > last_progress:
-                print('Upload progress: {0}%'.format(current_progress))
-                last_progress = current_progress
-    
+#several files at once in chunks that grow from 8MB while the connection keeps up. unfinished upload
+#sessions are kept in upld_folder/.transfer_state.json, rerun the script to continue them
+file_ids = upload_files(DriveBackend(service), [os.path.join('upld_folder', name) for name in file_names], folder_id or None,
+                        [m or None for m in mime_types], max_workers=4, progress=print_progress)
+for file_name, file_id in zip(file_names, file_ids):
     print(f'Upload of {file_name} Complete!')
-    print(f'File ID: {response.get("id")}')
+    print(f'File ID: {file_id}')
 ####################without chunks and without progres bar##############################
 # from googleapiclient.http import MediaFileUpload
 # from Google import Create_Service